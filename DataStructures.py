@@ -1,11 +1,21 @@
 
 
 
+from array import array
+from bisect import bisect_right
 from collections import deque, namedtuple
-from itertools import islice
+from contextlib import contextmanager
+from functools import wraps
+from itertools import accumulate, islice
+from random import random
 
 
 __all__ = [
+	"ENGINES",
+	"EditHistory",
+	"FoldIndex",
+	"PieceTable",
+	"PieceTextArray",
 	"Selection",
 	"TextArray",
 ]
@@ -88,16 +98,227 @@ class Coordinate:
 	def __set__(self, instance, value):
 		instance.cursor[self.index] = value
 
+def changes_text(method):
+	"""Decorator for TextArray methods that change the text. Increments the
+	version of the TextArray so that anything computed from the text can tell
+	that it is out of date."""
+
+	@wraps(method)
+	def wrapper(self, *args, **kwargs):
+		self.version += 1
+		return method(self, *args, **kwargs)
+	return wrapper
+
+
+def _end_point(x, y, text):
+	"""Return the position just after text if it is inserted at (x, y)"""
+
+	newlines = text.count("\n")
+	if newlines:
+		return Point(len(text) - text.rindex("\n") - 1, y + newlines)
+	return Point(x + len(text), y)
+
+
+# text that was inserted or deleted at (x, y)
+_Change = namedtuple("_Change", ["inserted", "x", "y", "text"])
+
+
+class _Step:
+	"""Changes that are undone and redone together and the cursor position
+	before and after them"""
+
+	__slots__ = ("changes", "before", "after", "kind", "size")
+
+	def __init__(self, before, kind):
+		self.changes = []
+		self.before = before
+		self.after = before
+		self.kind = kind
+		self.size = 0
+
+
+class EditHistory:
+	"""A log of the changes made to a TextArray so that they can be undone and
+	redone. Only the text that was inserted or deleted is stored, never a copy
+	of the whole text.
+
+	Typing, backspacing or deleting one character at a time is merged into a
+	single step, typing is split into a step for each word. Once the stored
+	text is over max_size characters the oldest steps are forgotten.
+
+	Every change, including the ones made by undo and redo, is also passed
+	to the journal if there is one."""
+
+	step_size = 64  # characters of memory counted for each change
+
+	def __init__(self, max_size=1 << 24):
+		self.max_size = max_size
+		self.undo_steps = deque()
+		self.redo_steps = []
+		self.size = 0
+		self.recording = True
+		self.group_depth = 0
+		self.merging = True   # whether the next change can join the last step
+		self.journal = None   # has a record(change) method
+
+	def clear(self):
+		"""Forget every step"""
+
+		self.undo_steps.clear()
+		self.redo_steps.clear()
+		self.size = 0
+
+	@contextmanager
+	def group(self):
+		"""Make every change inside of the with block a single step"""
+
+		if not self.group_depth:
+			self.merging = False
+		self.group_depth += 1
+		try:
+			yield
+		finally:
+			self.group_depth -= 1
+			if not self.group_depth:
+				self.merging = False
+
+	def separate(self):
+		"""Start a new step with the next change"""
+
+		self.merging = False
+
+	def record(self, text_array, change, before, kind=None):
+		"""Add a change that was just made to text_array. before is the cursor
+		position before the change and kind is "type", "backspace" or "delete"
+		for single characters that can be merged with the ones before them."""
+
+		if self.journal is not None:
+			self.journal.record(change)
+		if not self.recording:
+			return
+		if self.redo_steps:
+			self.size -= sum(step.size for step in self.redo_steps)
+			self.redo_steps.clear()
+
+		last = self.undo_steps[-1] if self.undo_steps else None
+		grouped = self.group_depth and self.merging
+		if last is not None and not grouped and self.merges(last, change, kind):
+			step = last
+			previous = step.changes.pop()
+			change = self.merged(previous, change, kind)
+			added = len(change.text) - len(previous.text)
+		else:
+			if grouped and last is not None:
+				step = last
+			else:
+				step = _Step(tuple(before), None if self.group_depth else kind)
+				self.undo_steps.append(step)
+			added = len(change.text) + self.step_size
+		self.merging = True
+
+		step.changes.append(change)
+		step.after = tuple(text_array.cursor)
+		step.size += added
+		self.size += added
+		self.evict()
+
+	def merges(self, step, change, kind) -> bool:
+		"""Return whether a change of the given kind continues step"""
+
+		if not self.merging or kind is None or step.kind != kind:
+			return False
+		last = step.changes[-1]
+		if kind == "type":
+			if not change.text.isspace() and last.text[-1].isspace():
+				return False  # a new word
+			return (change.x, change.y) == _end_point(last.x, last.y, last.text)
+		if kind == "backspace":
+			return _end_point(change.x, change.y, change.text) == (last.x, last.y)
+		return (change.x, change.y) == (last.x, last.y)
+
+	@staticmethod
+	def merged(last, change, kind):
+		"""Return the change made by last followed by change"""
+
+		if kind == "backspace":
+			return change._replace(text=change.text + last.text)
+		return last._replace(text=last.text + change.text)
+
+	def evict(self):
+		"""Forget the oldest steps until the history fits in max_size"""
+
+		while self.size > self.max_size and self.undo_steps:
+			self.size -= self.undo_steps.popleft().size
+		while self.size > self.max_size and self.redo_steps:
+			self.size -= self.redo_steps.pop(0).size
+
+	def undo(self, text_array):
+		"""Undo the last step. Return (line, lines removed, lines added) for
+		each change made to the text."""
+
+		if not self.undo_steps:
+			return []
+		step = self.undo_steps.pop()
+		lines = [
+			self.apply(text_array, change, not change.inserted)
+			for change in reversed(step.changes)
+		]
+		text_array.cursor = list(step.before)
+		self.redo_steps.append(step)
+		self.merging = False
+		return lines
+
+	def redo(self, text_array):
+		"""Redo the last step that was undone. Return (line, lines removed,
+		lines added) for each change made to the text."""
+
+		if not self.redo_steps:
+			return []
+		step = self.redo_steps.pop()
+		lines = [
+			self.apply(text_array, change, change.inserted)
+			for change in step.changes
+		]
+		text_array.cursor = list(step.after)
+		self.undo_steps.append(step)
+		self.merging = False
+		return lines
+
+	def replay(self, text_array, changes):
+		"""Make (inserted, x, y, text) changes read back from a journal
+		without recording them"""
+
+		for change in map(_Change._make, changes):
+			self.apply(text_array, change, change.inserted)
+
+	def apply(self, text_array, change, insert):
+		"""Insert or delete the text of a change without recording it"""
+
+		self.recording = False
+		try:
+			text_array.cursor = [change.x, change.y]
+			if insert:
+				first, last = text_array.insert_text(change.text)
+				return (first, 0, last - first)
+			end = _end_point(change.x, change.y, change.text)
+			removed = text_array.delete_range(change.x, change.y, *end)
+			return (change.y, removed, 0)
+		finally:
+			self.recording = True
+
+
 class TextArray:
-	"""A class representing a holding the text as a deque of deques. Also keeps
-	track of the current cursor position."""
+	"""A class representing a holding the text as a deque of strings, one for
+	each line. Also keeps track of the current cursor position."""
 
 	x = Coordinate(0)
 	y = Coordinate(1)
 
 	def __init__(self):
-		self.lines = SliceDeque([SliceDeque()])
+		self.lines = SliceDeque([""])
 		self.cursor = [0, 0]  # x, y
+		self.version = 0
+		self.history = EditHistory()
 
 	def __getitem__(self, index):
 		return self.lines[index]
@@ -108,77 +329,829 @@ class TextArray:
 	def get_text(self) -> str:
 		"""Return the text as a string"""
 
-		return "\n".join("".join(line) for line in self.lines)
+		return "\n".join(self.lines)
+
+	def text_range(self, x1, y1, x2, y2) -> str:
+		"""Return the text from (x1, y1) up to (x2, y2)"""
 
+		if y1 == y2:
+			return self.lines[y1][x1:x2]
+		lines = self.lines[y1:y2 + 1]
+		lines[0] = lines[0][x1:]
+		lines[-1] = lines[-1][:x2]
+		return "\n".join(lines)
+
+	@changes_text
 	def set_text(self, text):
 		"""Set the text from a string and set the cursor to the beginning of
-		the text"""
+		the text. Forgets the edit history."""
 
-		t = text.split("\n")
-		self.lines = SliceDeque([SliceDeque(line) for line in t])
+		self.lines = SliceDeque(text.split("\n"))
 		self.cursor = [0, 0]
+		self.history.clear()
+
+	@changes_text
+	def append_text(self, text) -> int:
+		"""Add text to the end without moving the cursor or recording it in
+		the edit history, for loading a file a chunk at a time. Return the
+		number of lines added."""
+
+		lines = text.split("\n")
+		self.lines[-1] += lines[0]
+		self.lines.extend(lines[1:])
+		return len(lines) - 1
 
 	def current_line(self):
-		"""Return the line the cursor is on as a deque"""
+		"""Return the line the cursor is on as a string"""
 
 		return self.lines[self.y]
 
+	def iter_lines(self, start=0):
+		"""Return an iterator of the lines from line start to the end"""
+
+		return islice(self.lines, start, None)
+
+	def snapshot(self):
+		"""Return a copy of the text that can be read from another thread while
+		this TextArray is edited. Copies a reference to each line."""
+
+		copy = self.__class__()
+		copy.lines = SliceDeque(self.lines)
+		copy.cursor = list(self.cursor)
+		copy.version = self.version
+		return copy
+
+	def undo(self):
+		"""Undo the last change. Return (line, lines removed, lines added) for
+		each change made to the text."""
+
+		return self.history.undo(self)
+
+	def redo(self):
+		"""Redo the last change that was undone. Return (line, lines removed,
+		lines added) for each change made to the text."""
+
+		return self.history.redo(self)
+
+	@changes_text
 	def insert(self, char):
 		"""Insert the given character at the cursor position"""
 
-		self.current_line().insert(self.x, char)
+		x, y = self.cursor
+		line = self.current_line()
+		self.lines[y] = line[:x] + char + line[x:]
 		self.x += 1
+		self.history.record(self, _Change(True, x, y, char), (x, y), "type")
+
+	@changes_text
+	def insert_text(self, text) -> tuple[int]:
+		"""Insert a string that may contain newlines at the cursor position in
+		one step and move the cursor to the end of it.
+
+		Return (first line, last line) of the lines that were changed. Any
+		lines after the first one are new."""
+
+		x, first = self.cursor
+		parts = text.split("\n")
+		line = self.current_line()
+		after = line[x:]
+		if len(parts) == 1:
+			self.lines[first] = line[:x] + text + after
+			self.x += len(text)
+		else:
+			self.lines[first] = line[:x] + parts[0]
+			new_lines = parts[1:]
+			self.x = len(new_lines[-1])
+			new_lines[-1] += after
 
+			# insert all of the new lines with a single pass over the deque
+			self.lines.rotate(-(first + 1))
+			self.lines.extendleft(reversed(new_lines))
+			self.lines.rotate(first + 1)
+			self.y = first + len(new_lines)
+		self.history.record(self, _Change(True, x, first, text), (x, first))
+		return (first, self.y)
+
+	@changes_text
 	def duplicate_line(self):
 		"""Duplicate the line the cursor is on"""
 
-		self.lines.insert(self.y, SliceDeque(self.current_line()))
+		x, y = self.cursor
+		line = self.current_line()
+		self.lines.insert(y, line)
 		self.y += 1
+		self.history.record(self, _Change(True, 0, y, line + "\n"), (x, y))
 
+	@changes_text
 	def newline(self):
 		"""Insert a newline at the cursor position and move any text after the
 		cursor to the new line"""
 
-		remaining_text = ""
-		if remaining_text := self.current_line()[self.x:]:
-			# TODO: should do differently depending on which side of the line the cursor is closer to
-			del self.current_line()[self.x:self.x + len(remaining_text)]
-		self.lines.insert(self.y + 1, SliceDeque(remaining_text))
+		x, y = self.cursor
+		line = self.current_line()
+		self.lines[y] = line[:x]
+		self.lines.insert(y + 1, line[x:])
 		self.y += 1
 		self.x = 0
+		self.history.record(self, _Change(True, x, y, "\n"), (x, y))
 
+	@changes_text
 	def backspace(self) -> tuple[int]:
 		"""Delete the character behind the cursor.
 
 		Return (line number, 0|1|2) if 0, 1, or more than one line needs to be
 		updated."""
 
-		if self.x > 0:
-			del self.current_line()[self.x - 1]
+		x, y = self.cursor
+		if x > 0:
+			line = self.current_line()
+			self.lines[y] = line[:x - 1] + line[x:]
 			self.x -= 1
+			change = _Change(False, x - 1, y, line[x - 1])
+			self.history.record(self, change, (x, y), "backspace")
 			return (self.y, 1)
-		elif self.y > 0:
-			length = len(self.lines[self.y - 1])
-			self.lines[self.y - 1].extend(self.current_line())
-			del self.lines[self.y]
+		elif y > 0:
+			length = len(self.lines[y - 1])
+			self.lines[y - 1] += self.current_line()
+			del self.lines[y]
 			self.y -= 1
 			self.x = length
+			change = _Change(False, length, y - 1, "\n")
+			self.history.record(self, change, (x, y), "backspace")
 			return (self.y, 2)
 		return (-1, 0)
 
+	@changes_text
 	def delete(self):
 		"""Delete the character infront of the cursor and return a tuple
 		containing the the line the cursor is on and whether no lines need to
 		be updated, only the current line, or all lines after the current
 		line. (line number, 0|1|2)"""
 
-		if self.x < len(self.current_line()):
-			del self.current_line()[self.x]
+		x, y = self.cursor
+		line = self.current_line()
+		if x < len(line):
+			self.lines[y] = line[:x] + line[x + 1:]
+			change = _Change(False, x, y, line[x])
+			self.history.record(self, change, (x, y), "delete")
+			return (y, 1)
+		elif y < len(self.lines) - 1:
+			self.lines[y] = line + self.lines[y + 1]
+			del self.lines[y + 1]
+			change = _Change(False, x, y, "\n")
+			self.history.record(self, change, (x, y), "delete")
+			return (y, 2)
+		return (-1, 0)
+
+	@changes_text
+	def delete_range(self, x1, y1, x2, y2) -> int:
+		"""Delete the text from (x1, y1) up to (x2, y2) and move the cursor to
+		the start of it. The start must come before the end.
+
+		Return the number of lines that were removed."""
+
+		before = tuple(self.cursor)
+		removed = self.text_range(x1, y1, x2, y2)
+		self.lines[y1] = self.lines[y1][:x1] + self.lines[y2][x2:]
+		if y2 > y1:
+			del self.lines[y1 + 1:y2 + 1]
+		self.cursor = [x1, y1]
+		self.history.record(self, _Change(False, x1, y1, removed), before)
+		return y2 - y1
+
+
+def _line_breaks(text, base=0):
+	"""Return an iterator of the offsets just after every newline in text,
+	counting from base"""
+
+	# summed from the lengths of the lines, the last one has no newline
+	offsets = accumulate(
+		map(len, text.split("\n")[:-1]),
+		lambda total, length: total + length + 1,
+		initial=base
+	)
+	next(offsets)
+	return offsets
+
+
+class _Buffer:
+	"""Text that pieces point into along with the offsets at which its lines
+	start. Buffers are only ever appended to so pieces stay valid."""
+
+	__slots__ = ("text", "breaks")
+
+	def __init__(self, text=""):
+		self.text = ""
+		self.breaks = array("q")
+		self.append(text)
+
+	def append(self, text):
+		"""Add text to the end of the buffer"""
+
+		self.breaks.extend(_line_breaks(text, len(self.text)))
+		self.text += text
+
+	def newlines(self, start, end) -> int:
+		"""Return the number of newlines in text[start:end]"""
+
+		return bisect_right(self.breaks, end) - bisect_right(self.breaks, start)
+
+
+class _Node:
+	"""A piece of a buffer and a node in the piece tree. Nodes are never
+	modified once they are created."""
+
+	__slots__ = (
+		"buffer", "start", "length", "newlines", "priority",
+		"left", "right", "size", "lines",
+	)
+
+	def __init__(
+		self,
+		buffer,
+		start,
+		length,
+		priority=None,
+		left=None,
+		right=None,
+		newlines=None,
+	):
+		self.buffer = buffer
+		self.start = start
+		self.length = length
+		if newlines is None:
+			newlines = buffer.newlines(start, start + length)
+		self.newlines = newlines
+		self.priority = random() if priority is None else priority
+		self.left = left
+		self.right = right
+
+		# totals for the whole subtree
+		self.size = length
+		self.lines = newlines
+		if left is not None:
+			self.size += left.size
+			self.lines += left.lines
+		if right is not None:
+			self.size += right.size
+			self.lines += right.lines
+
+	def with_children(self, left, right):
+		"""Return a copy of the node with different children"""
+
+		return _Node(
+			self.buffer,
+			self.start,
+			self.length,
+			self.priority,
+			left,
+			right,
+			self.newlines,
+		)
+
+
+def _merge(a, b):
+	"""Join two piece trees, all of a's text comes before b's"""
+
+	if a is None:
+		return b
+	if b is None:
+		return a
+	if a.priority > b.priority:
+		return a.with_children(a.left, _merge(a.right, b))
+	return b.with_children(_merge(a, b.left), b.right)
+
+
+def _split(node, offset):
+	"""Split a piece tree into the first offset characters and the rest"""
+
+	if node is None or offset <= 0:
+		return None, node
+	if offset >= node.size:
+		return node, None
+	left_size = node.left.size if node.left is not None else 0
+	if offset <= left_size:
+		a, b = _split(node.left, offset)
+		return a, node.with_children(b, node.right)
+	offset -= left_size
+	if offset >= node.length:
+		a, b = _split(node.right, offset - node.length)
+		return node.with_children(node.left, a), b
+
+	# the split is in the middle of this piece
+	first = _Node(node.buffer, node.start, offset)
+	second = _Node(node.buffer, node.start + offset, node.length - offset)
+	return _merge(node.left, first), _merge(second, node.right)
+
+
+def _last(node):
+	"""Return the last piece in a piece tree"""
+
+	while node.right is not None:
+		node = node.right
+	return node
+
+
+def _slices(node, start, end, base=0):
+	"""Yield the strings that make up text[start:end] of the piece tree whose
+	first character is at offset base"""
+
+	while node is not None:
+		node_start = base + (node.left.size if node.left is not None else 0)
+		node_end = node_start + node.length
+		if start < node_start:
+			yield from _slices(node.left, start, end, base)
+		if start < node_end and end > node_start:
+			s = max(start, node_start) - node_start + node.start
+			e = min(end, node_end) - node_start + node.start
+			yield node.buffer.text[s:e]
+		if end <= node_end:
+			return
+		base = node_end
+		node = node.right
+
+
+class PieceTable:
+	"""Text stored as a balanced tree of pieces of append only buffers.
+
+	Inserting, deleting and finding the start of a line all take O(log n)
+	time where n is the number of pieces."""
+
+	# typed text goes into the same add buffer until it is this long
+	add_buffer_size = 1 << 16
+	# number of characters read at a time by lines()
+	read_size = 1 << 20
+	# lines kept by line() before the cache is cleared
+	cached_lines = 1000
+
+	def __init__(self, text=""):
+		self.root = None
+		self.add_buffer = _Buffer()
+		if text:
+			self.root = _Node(_Buffer(text), 0, len(text))
+		# line number: line, for the tree in line_cache_root. Every edit
+		# replaces the root, so the lines are kept until the next edit.
+		self.line_cache = {}
+		self.line_cache_root = self.root
+
+	def __len__(self):
+		return self.root.size if self.root is not None else 0
+
+	def line_count(self) -> int:
+		"""Return the number of lines, one more than the number of newlines"""
+
+		return (self.root.lines if self.root is not None else 0) + 1
+
+	def line_start(self, y) -> int:
+		"""Return the offset of the first character of line y"""
+
+		if y <= 0:
+			return 0
+		if y >= self.line_count():
+			raise IndexError("line index out of range")
+
+		node = self.root
+		base = 0
+		while True:
+			left_lines = node.left.lines if node.left is not None else 0
+			if y <= left_lines:
+				node = node.left
+				continue
+			y -= left_lines
+			base += node.left.size if node.left is not None else 0
+			if y <= node.newlines:
+				breaks = node.buffer.breaks
+				i = bisect_right(breaks, node.start) + y - 1
+				return base + breaks[i] - node.start
+			y -= node.newlines
+			base += node.length
+			node = node.right
+
+	def line_end(self, y) -> int:
+		"""Return the offset of the newline at the end of line y or the end
+		of the text if y is the last line"""
+
+		if y + 1 >= self.line_count():
+			return len(self)
+		return self.line_start(y + 1) - 1
+
+	def line(self, y) -> str:
+		"""Return line y without its newline. Lines are cached until the text
+		is edited, so reading the same line again takes O(1) time."""
+
+		if self.line_cache_root is not self.root or len(self.line_cache) >= self.cached_lines:
+			self.line_cache.clear()
+			self.line_cache_root = self.root
+		line = self.line_cache.get(y)
+		if line is None:
+			line = self.line_cache[y] = self.text(self.line_start(y), self.line_end(y))
+		return line
+
+	def lines(self, start=0):
+		"""Yield the lines from line start to the end without their newlines.
+		The text is read a chunk at a time rather than all at once."""
+
+		partial = ""
+		offset = self.line_start(start)
+		end = len(self)
+		while offset < end:
+			chunk = self.text(offset, offset + self.read_size)
+			offset += len(chunk)
+			lines = (partial + chunk).split("\n")
+			partial = lines.pop()
+			yield from lines
+		yield partial
+
+	def text(self, start=0, end=None) -> str:
+		"""Return the text from start to end"""
+
+		if end is None:
+			end = len(self)
+		if start >= end:
+			return ""
+		return "".join(_slices(self.root, start, end))
+
+	def insert(self, offset, text):
+		"""Insert text at the given offset"""
+
+		if not text:
+			return
+		before, after = _split(self.root, offset)
+		buffer = self.add_buffer
+
+		if len(text) > self.add_buffer_size:
+			# large inserts get a buffer of their own
+			node = _Node(_Buffer(text), 0, len(text))
+		elif (
+			before is not None
+			and (last := _last(before)).buffer is buffer
+			and last.start + last.length == len(buffer.text)
+			and len(buffer.text) + len(text) <= self.add_buffer_size
+		):
+			# typing right after the previous insert extends its piece
+			buffer.append(text)
+			before, _ = _split(before, before.size - last.length)
+			node = _Node(buffer, last.start, last.length + len(text))
+		else:
+			if len(buffer.text) + len(text) > self.add_buffer_size:
+				buffer = self.add_buffer = _Buffer()
+			start = len(buffer.text)
+			buffer.append(text)
+			node = _Node(buffer, start, len(text))
+
+		self.root = _merge(_merge(before, node), after)
+
+	def copy(self):
+		"""Return a PieceTable with the same text that shares the piece tree
+		and buffers but not the add buffer it is typing into"""
+
+		copy = self.__class__()
+		copy.root = self.root
+		return copy
+
+	def delete(self, start, end):
+		"""Delete the text from start to end"""
+
+		if start >= end:
+			return
+		before, rest = _split(self.root, start)
+		_, after = _split(rest, end - start)
+		self.root = _merge(before, after)
+
+
+class PieceTextArray:
+	"""A TextArray that holds the text in a PieceTable rather than a deque of
+	deques. Edits and line lookups take O(log n) time instead of time
+	proportional to the size of the file."""
+
+	x = Coordinate(0)
+	y = Coordinate(1)
+
+	def __init__(self):
+		self.table = PieceTable()
+		self.cursor = [0, 0]  # x, y
+		self.version = 0
+		self.history = EditHistory()
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("line index out of range")
+		return self.table.line(index)
+
+	def __len__(self):
+		return self.table.line_count()
+
+	def offset(self, x=None, y=None) -> int:
+		"""Return the offset into the text of the given position. Defaults to
+		the cursor position"""
+
+		if x is None:
+			x = self.x
+		if y is None:
+			y = self.y
+		return self.table.line_start(y) + x
+
+	def get_text(self) -> str:
+		"""Return the text as a string"""
+
+		return self.table.text()
+
+	def text_range(self, x1, y1, x2, y2) -> str:
+		"""Return the text from (x1, y1) up to (x2, y2)"""
+
+		return self.table.text(self.offset(x1, y1), self.offset(x2, y2))
+
+	@changes_text
+	def set_text(self, text):
+		"""Set the text from a string and set the cursor to the beginning of
+		the text. Forgets the edit history."""
+
+		self.table = PieceTable(text)
+		self.cursor = [0, 0]
+		self.history.clear()
+
+	@changes_text
+	def append_text(self, text) -> int:
+		"""Add text to the end without moving the cursor or recording it in
+		the edit history, for loading a file a chunk at a time. Return the
+		number of lines added."""
+
+		self.table.insert(len(self.table), text)
+		return text.count("\n")
+
+	def current_line(self):
+		"""Return the line the cursor is on as a string"""
+
+		return self[self.y]
+
+	def iter_lines(self, start=0):
+		"""Return an iterator of the lines from line start to the end"""
+
+		return self.table.lines(start)
+
+	def snapshot(self):
+		"""Return a copy of the text that can be read from another thread while
+		this TextArray is edited. Takes O(1) time since the piece tree is
+		never modified in place."""
+
+		copy = self.__class__()
+		copy.table = self.table.copy()
+		copy.cursor = list(self.cursor)
+		copy.version = self.version
+		return copy
+
+	def undo(self):
+		"""Undo the last change. Return (line, lines removed, lines added) for
+		each change made to the text."""
+
+		return self.history.undo(self)
+
+	def redo(self):
+		"""Redo the last change that was undone. Return (line, lines removed,
+		lines added) for each change made to the text."""
+
+		return self.history.redo(self)
+
+	@changes_text
+	def insert(self, char):
+		"""Insert the given character at the cursor position"""
+
+		x, y = self.cursor
+		self.table.insert(self.offset(), char)
+		self.x += 1
+		self.history.record(self, _Change(True, x, y, char), (x, y), "type")
+
+	@changes_text
+	def insert_text(self, text) -> tuple[int]:
+		"""Insert a string that may contain newlines at the cursor position in
+		one step and move the cursor to the end of it.
+
+		Return (first line, last line) of the lines that were changed. Any
+		lines after the first one are new."""
+
+		x, first = self.cursor
+		self.table.insert(self.offset(), text)
+		self.cursor = list(_end_point(x, first, text))
+		self.history.record(self, _Change(True, x, first, text), (x, first))
+		return (first, self.y)
+
+	@changes_text
+	def duplicate_line(self):
+		"""Duplicate the line the cursor is on"""
+
+		x, y = self.cursor
+		line = self.current_line() + "\n"
+		self.table.insert(self.offset(0), line)
+		self.y += 1
+		self.history.record(self, _Change(True, 0, y, line), (x, y))
+
+	@changes_text
+	def newline(self):
+		"""Insert a newline at the cursor position and move any text after the
+		cursor to the new line"""
+
+		x, y = self.cursor
+		self.table.insert(self.offset(), "\n")
+		self.y += 1
+		self.x = 0
+		self.history.record(self, _Change(True, x, y, "\n"), (x, y))
+
+	@changes_text
+	def backspace(self) -> tuple[int]:
+		"""Delete the character behind the cursor.
+
+		Return (line number, 0|1|2) if 0, 1, or more than one line needs to be
+		updated."""
+
+		x, y = self.cursor
+		offset = self.offset()
+		if x > 0:
+			char = self.table.text(offset - 1, offset)
+			self.table.delete(offset - 1, offset)
+			self.x -= 1
+			change = _Change(False, x - 1, y, char)
+			self.history.record(self, change, (x, y), "backspace")
 			return (self.y, 1)
-		elif self.y < len(self.lines) - 1:
-			self.current_line().extend(self.lines[self.y + 1])
-			del self.lines[self.y + 1]
+		elif y > 0:
+			self.y -= 1
+			self.x = offset - 1 - self.table.line_start(self.y)
+			self.table.delete(offset - 1, offset)
+			change = _Change(False, self.x, self.y, "\n")
+			self.history.record(self, change, (x, y), "backspace")
 			return (self.y, 2)
 		return (-1, 0)
 
+	@changes_text
+	def delete(self):
+		"""Delete the character infront of the cursor and return a tuple
+		containing the the line the cursor is on and whether no lines need to
+		be updated, only the current line, or all lines after the current
+		line. (line number, 0|1|2)"""
+
+		x, y = self.cursor
+		offset = self.offset()
+		if offset < self.table.line_end(y):
+			to_update = (y, 1)
+		elif y < len(self) - 1:
+			to_update = (y, 2)
+		else:
+			return (-1, 0)
+		char = self.table.text(offset, offset + 1)
+		self.table.delete(offset, offset + 1)
+		self.history.record(self, _Change(False, x, y, char), (x, y), "delete")
+		return to_update
+
+	@changes_text
+	def delete_range(self, x1, y1, x2, y2) -> int:
+		"""Delete the text from (x1, y1) up to (x2, y2) and move the cursor to
+		the start of it. The start must come before the end.
+
+		Return the number of lines that were removed."""
+
+		before = tuple(self.cursor)
+		start = self.offset(x1, y1)
+		end = self.offset(x2, y2)
+		removed = self.table.text(start, end)
+		self.table.delete(start, end)
+		self.cursor = [x1, y1]
+		self.history.record(self, _Change(False, x1, y1, removed), before)
+		return y2 - y1
+
+
+class FoldIndex:
+	"""The ranges of lines that are hidden by folds, kept sorted along with
+	how many lines are hidden before each one. Converts between line numbers
+	and the rows they are drawn on in O(log n) time where n is the number of
+	folds, no matter how many lines they hide."""
+
+	def __init__(self):
+		self.starts = []   # the first hidden line of each fold
+		self.ends = []     # the line after the last hidden line of each fold
+		self.rows = []     # the row of the line after each fold
+		self.hidden_before = [0]   # lines hidden by the folds before each fold
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __iter__(self):
+		"""Yield (start, end) of the lines hidden by each fold"""
+
+		return zip(self.starts, self.ends)
+
+	def hidden_count(self) -> int:
+		"""Return the number of lines hidden by all of the folds"""
+
+		return self.hidden_before[-1]
+
+	def _reindex(self):
+		"""Recompute the rows and hidden line counts after the folds change"""
+
+		self.hidden_before = list(accumulate(
+			(end - start for start, end in self),
+			initial=0
+		))
+		self.rows = [
+			start - hidden
+			for start, hidden in zip(self.starts, self.hidden_before)
+		]
+
+	def fold(self, start, end):
+		"""Hide the lines from start up to end. Folds inside of it are replaced
+		by it.
+
+		Return the number of lines that were not already hidden."""
+
+		i = bisect_right(self.starts, start - 1)
+		j = i
+		while j < len(self) and self.starts[j] < end:
+			end = max(end, self.ends[j])
+			j += 1
+		already = sum(self.ends[k] - self.starts[k] for k in range(i, j))
+		self.starts[i:j] = [start]
+		self.ends[i:j] = [end]
+		self._reindex()
+		return end - start - already
+
+	def unfold(self, first, last=None):
+		"""Remove the folds whose first line or hidden lines overlap the lines
+		from first to last.
+
+		Return (start, end) of the lines hidden by each removed fold."""
+
+		if last is None:
+			last = first
+		i = bisect_right(self.ends, first)
+		j = bisect_right(self.starts, last + 1)
+		removed = list(zip(self.starts[i:j], self.ends[i:j]))
+		if removed:
+			del self.starts[i:j]
+			del self.ends[i:j]
+			self._reindex()
+		return removed
+
+	def shift(self, start, count):
+		"""Move the folds at or after line start down by count lines"""
+
+		i = bisect_right(self.starts, start - 1)
+		if i == len(self):
+			return
+		self.starts[i:] = [line + count for line in self.starts[i:]]
+		self.ends[i:] = [line + count for line in self.ends[i:]]
+		self._reindex()
+
+	def header(self, line_number) -> bool:
+		"""Return whether a line is folded, that the lines after it are hidden"""
+
+		i = bisect_right(self.starts, line_number + 1) - 1
+		return i >= 0 and self.starts[i] == line_number + 1
+
+	def hidden(self, line_number) -> bool:
+		"""Return whether a line is hidden by a fold"""
+
+		i = bisect_right(self.starts, line_number) - 1
+		return i >= 0 and line_number < self.ends[i]
+
+	def row(self, line_number) -> int:
+		"""Return the row a line is drawn on. Hidden lines are on the row of
+		the line their fold starts after."""
+
+		i = bisect_right(self.starts, line_number)
+		if i and line_number < self.ends[i - 1]:
+			return self.rows[i - 1] - 1
+		return line_number - self.hidden_before[i]
+
+	def line(self, row) -> int:
+		"""Return the line drawn on a row"""
+
+		return row + self.hidden_before[bisect_right(self.rows, row)]
+
+	def segments(self, start, stop):
+		"""Yield (first, last + 1) of each run of lines that are not hidden
+		between start and stop"""
+
+		i = bisect_right(self.ends, start)
+		while start < stop:
+			if i < len(self) and self.starts[i] < stop:
+				if start < self.starts[i]:
+					yield start, self.starts[i]
+				start = self.ends[i]
+				i += 1
+			else:
+				yield start, stop
+				return
+
+	def visible(self, start, stop):
+		"""Yield the lines that are not hidden between start and stop"""
+
+		for first, last in self.segments(start, stop):
+			yield from range(first, last)
+
+
+# ways of storing the text that a Tab can be created with
+ENGINES = {
+	"deque": TextArray,
+	"piece": PieceTextArray,
+}
 
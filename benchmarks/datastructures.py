@@ -0,0 +1,198 @@
+"""Time the edits the editor makes to its text, without Tk, and compare them
+to a saved baseline.
+
+Each case is timed on buffers of every size with every engine, and the
+slicing TextArray relies on is timed on a SliceDeque by itself. The fastest
+of several repeats is kept, each repeat starting from a new buffer. Usage:
+
+	python benchmarks/datastructures.py --save     # record a baseline
+	python benchmarks/datastructures.py            # fail if slower than it
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataStructures import *
+from DataStructures import SliceDeque
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datastructures.json")
+
+EDITS = 200   # edits timed in each repeat, fewer than half of the smallest size
+
+
+def make_text(lines) -> str:
+	return "\n".join(f"{n:>8} the quick brown fox jumps over the lazy dog" for n in range(lines))
+
+
+# each case takes a buffer, puts the cursor where it is needed and returns
+# a function that makes one edit
+
+
+def type_at(where):
+	def case(text_array):
+		y = {"start": 0, "middle": len(text_array) // 2, "end": len(text_array) - 1}[where]
+		x = 0 if where == "start" else len(text_array[y]) // 2
+		text_array.cursor = [x, y]
+		return lambda: text_array.insert("a")
+	return case
+
+
+def newline(text_array):
+	text_array.cursor = [5, len(text_array) // 2]
+	return text_array.newline
+
+
+def backspace_join(text_array):
+	y = len(text_array) // 2
+
+	def edit():
+		text_array.cursor = [0, y]
+		text_array.backspace()   # joins line y onto the line above it
+	return edit
+
+
+def duplicate_line(text_array):
+	text_array.cursor = [0, len(text_array) // 2]
+	return text_array.duplicate_line
+
+
+def get_text(text_array):
+	return text_array.get_text
+
+
+def set_get_round_trip(text_array):
+	return lambda: text_array.set_text(text_array.get_text())
+
+
+# the deque cases take the SliceDeque that TextArray keeps its lines in
+
+
+def deque_getitem(lines):
+	middle = len(lines) // 2
+	return lambda: lines[middle:middle + 100]
+
+
+def deque_delitem(lines):
+	middle = len(lines) // 2
+
+	def edit():
+		del lines[middle:middle + 2]
+	return edit
+
+
+# name: (case, whether it works on the whole text)
+CASES = {
+	"type start": (type_at("start"), False),
+	"type middle": (type_at("middle"), False),
+	"type end": (type_at("end"), False),
+	"newline": (newline, False),
+	"backspace join": (backspace_join, False),
+	"duplicate line": (duplicate_line, False),
+	"get_text": (get_text, True),
+	"set_text get_text": (set_get_round_trip, True),
+}
+
+DEQUE_CASES = {
+	"slice": deque_getitem,
+	"del slice": deque_delitem,
+}
+
+
+def time_case(engine, name, lines, repeat):
+	"""Return the fastest time in seconds of one edit. The engine "SliceDeque"
+	runs the DEQUE_CASES."""
+
+	if engine == "SliceDeque":
+		case, whole_text = DEQUE_CASES[name], False
+	else:
+		case, whole_text = CASES[name]
+	number = max(1, 200_000 // lines) if whole_text else EDITS
+	text = make_text(lines)
+	best = float("inf")
+	for _ in range(repeat):
+		if engine == "SliceDeque":
+			buffer = SliceDeque(text.split("\n"))
+		else:
+			buffer = ENGINES[engine]()
+			buffer.set_text(text)
+		edit = case(buffer)
+		best = min(best, timeit.timeit(edit, number=number) / number)
+	return best
+
+
+def main():
+	parser = ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument(
+		"--sizes",
+		nargs="+",
+		type=int,
+		default=[1_000, 100_000, 1_000_000],
+		help="lines in each buffer"
+	)
+	parser.add_argument(
+		"--engines",
+		nargs="+",
+		choices=[*ENGINES, "SliceDeque"],
+		default=[*ENGINES, "SliceDeque"]
+	)
+	parser.add_argument(
+		"--cases",
+		nargs="+",
+		choices=[*CASES, *DEQUE_CASES],
+		default=[*CASES, *DEQUE_CASES]
+	)
+	parser.add_argument("--repeat", type=int, default=7)
+	parser.add_argument("--baseline", default=BASELINE)
+	parser.add_argument(
+		"--save",
+		action="store_true",
+		help="save the results as the baseline instead of comparing them to it"
+	)
+	parser.add_argument(
+		"--tolerance",
+		type=float,
+		default=0.25,
+		help="fraction a case can be slower than the baseline before it fails"
+	)
+	args = parser.parse_args()
+
+	baseline = {}
+	if not args.save and os.path.exists(args.baseline):
+		with open(args.baseline) as file:
+			baseline = json.load(file)
+
+	results = {}
+	regressions = []
+	print(f"{'engine':>10} {'case':>17} {'lines':>9} {'time':>11} {'baseline':>11}")
+	for engine in args.engines:
+		cases = DEQUE_CASES if engine == "SliceDeque" else CASES
+		for name in args.cases:
+			if name not in cases:
+				continue
+			for lines in args.sizes:
+				key = f"{engine}/{name}/{lines}"
+				seconds = time_case(engine, name, lines, args.repeat)
+				results[key] = seconds
+				line = f"{engine:>10} {name:>17} {lines:>9} {seconds * 1e6:>9.2f}us"
+				if key in baseline:
+					line += f" {baseline[key] * 1e6:>9.2f}us"
+					if seconds > baseline[key] * (1 + args.tolerance):
+						regressions.append(key)
+						line += " slower"
+				print(line)
+
+	if args.save:
+		with open(args.baseline, "w") as file:
+			json.dump(results, file, indent="\t", sort_keys=True)
+		print(f"saved the baseline to {args.baseline}")
+	elif regressions:
+		sys.exit(f"{len(regressions)} cases are over {args.tolerance:.0%} slower than the baseline")
+
+
+if __name__ == "__main__":
+	main()
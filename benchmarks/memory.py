@@ -0,0 +1,138 @@
+"""Compare the peak memory used to hold a large file in each of the ways the
+editor can store text.
+
+Every measurement runs in its own process so the peak resident set size of
+one layout does not hide that of another. Usage:
+
+	python benchmarks/memory.py --sizes 10 100 500
+"""
+
+from argparse import ArgumentParser, SUPPRESS
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataStructures import *
+from DataStructures import SliceDeque
+
+
+def chars_layout(text):
+	"""The layout used before lines were stored as strings, a deque of deques
+	of single characters"""
+
+	return SliceDeque([SliceDeque(line) for line in text.split("\n")])
+
+
+def engine_layout(name):
+	"""Return a function that loads text into the given engine"""
+
+	def load(text):
+		text_array = ENGINES[name]()
+		text_array.set_text(text)
+		return text_array
+	return load
+
+
+LAYOUTS = {
+	"chars": chars_layout,
+	**{name: engine_layout(name) for name in ENGINES},
+}
+
+
+def peak_rss() -> int:
+	"""Return the peak resident set size of this process in bytes"""
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# linux reports kilobytes and macos reports bytes
+	return peak if sys.platform == "darwin" else peak * 1024
+
+
+def generate(path, megabytes):
+	"""Write a log like file of about the given size"""
+
+	line = "2024-01-01 12:00:00 INFO worker-{:04} handled request in {:>5} ms\n"
+	size = megabytes * 1024 * 1024
+	written = 0
+	i = 0
+	with open(path, "w") as file:
+		while written < size:
+			chunk = "".join(line.format(j % 10000, j % 99991) for j in range(i, i + 1000))
+			file.write(chunk)
+			written += len(chunk)
+			i += 1000
+
+
+def measure(layout, path):
+	"""Load the file into the layout and print the peak memory used. Run in
+	the child process."""
+
+	with open(path, "r") as file:
+		text = file.read()
+	before = peak_rss()
+	loaded = LAYOUTS[layout](text)
+	del text
+	print(before, peak_rss())
+	return loaded
+
+
+def run(layout, path):
+	"""Measure a layout in a new process and return (peak before loading,
+	peak after loading) in bytes or None if the process failed"""
+
+	result = subprocess.run(
+		[sys.executable, __file__, "--child", layout, path],
+		capture_output=True,
+		text=True,
+	)
+	if result.returncode != 0:
+		return None
+	return tuple(map(int, result.stdout.split()))
+
+
+def main():
+	parser = ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument(
+		"--sizes",
+		nargs="+",
+		type=int,
+		default=[10, 100, 500],
+		help="sizes of the generated files in megabytes"
+	)
+	parser.add_argument(
+		"--layouts",
+		nargs="+",
+		choices=LAYOUTS,
+		default=list(LAYOUTS),
+	)
+	parser.add_argument("--child", nargs=2, help=SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		measure(*args.child)
+		return
+
+	mb = 1024 * 1024
+	print(f"{'size':>8} {'layout':>8} {'before':>10} {'after':>10} {'per char':>9}")
+	with tempfile.TemporaryDirectory() as directory:
+		for size in args.sizes:
+			path = os.path.join(directory, f"{size}.log")
+			generate(path, size)
+			chars = os.path.getsize(path)
+			for layout in args.layouts:
+				result = run(layout, path)
+				if result is None:
+					print(f"{size:>6}MB {layout:>8} {'failed (out of memory?)':>31}")
+					continue
+				before, after = result
+				print(
+					f"{size:>6}MB {layout:>8} {before / mb:>8.1f}MB "
+					f"{after / mb:>8.1f}MB {(after - before) / chars:>8.1f}B"
+				)
+
+
+if __name__ == "__main__":
+	main()
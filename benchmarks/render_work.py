@@ -0,0 +1,486 @@
+"""Count the canvas and font calls that edits make, to check that the work of
+drawing an edit depends on the lines in view rather than the length of the
+document.
+
+Tk is replaced by stand-ins that record what is drawn instead of drawing it,
+so no display is needed. Each scenario is run on documents of every size and
+fails if the most calls one edit makes is over its bound, which depends on
+the lines in view but not on the length of the document. Usage:
+
+	python benchmarks/render_work.py --sizes 1000 100000 1000000
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import text_editor
+from text_editor import DummyEvent, ENGINES, Journal, Selection, Session
+
+CALLS = Counter()   # name of the canvas or font method: times it was called
+COUNTED = ("create_text", "create_rectangle", "delete", "moveto", "bbox", "measure")
+
+
+class EventLoop:
+	"""Runs the callbacks that the editor schedules with after and after_idle.
+	Callbacks scheduled further ahead than longest_wait ms, such as saving
+	the session every minute, are never run."""
+
+	longest_wait = 50
+
+	def __init__(self):
+		self.pending = {}   # id: (seconds to wait, function, arguments)
+		self.next_id = 0
+
+	def after(self, ms, func=None, *args):
+		self.next_id += 1
+		if ms <= self.longest_wait:
+			self.pending[self.next_id] = (ms / 1000, func, args)
+		return f"after#{self.next_id}"
+
+	def after_idle(self, func, *args):
+		return self.after(0, func, *args)
+
+	def after_cancel(self, ident):
+		self.pending.pop(int(ident.removeprefix("after#")), None)
+
+	def update(self):
+		"""Run callbacks until none are pending"""
+
+		while self.pending:
+			ident = next(iter(self.pending))
+			wait, func, args = self.pending.pop(ident)
+			time.sleep(wait)
+			func(*args)
+
+
+LOOP = EventLoop()
+
+
+class Widget:
+	"""A widget that is never shown. Methods that only lay it out or change
+	how it looks do nothing."""
+
+	def __init__(self, master=None, **options):
+		self.options = options
+
+	def __getitem__(self, option):
+		return self.options[option]
+
+	def config(self, **options):
+		self.options.update(options)
+
+	configure = config
+
+	def after(self, ms, func=None, *args):
+		return LOOP.after(ms, func, *args)
+
+	def after_idle(self, func, *args):
+		return LOOP.after_idle(func, *args)
+
+	def after_cancel(self, ident):
+		LOOP.after_cancel(ident)
+
+	def winfo_exists(self):
+		return True
+
+	def __getattr__(self, name):
+		return lambda *args, **kwargs: None
+
+
+class Variable:
+	def __init__(self, master=None, value=None):
+		self.value = value
+
+	def get(self):
+		return self.value
+
+	def set(self, value):
+		self.value = value
+
+	def trace_add(self, mode, callback):
+		pass
+
+
+class Scrollbar(Widget):
+	def get(self):
+		return self.options.get("position", (0.0, 1.0))
+
+	def set(self, first, last):
+		self.options["position"] = (float(first), float(last))
+
+
+class Item:
+	def __init__(self, kind, coords, options):
+		tags = options.pop("tag", options.pop("tags", ()))
+		self.kind = kind
+		self.coords = list(coords)
+		self.tags = {tags} if isinstance(tags, str) else set(tags)
+		self.options = options
+
+
+class Canvas(Widget):
+	"""A canvas that keeps its items and scroll position and counts the calls
+	made to it"""
+
+	def __init__(self, master=None, **options):
+		options.setdefault("width", 500)
+		options.setdefault("height", 400)
+		super().__init__(master, **options)
+		self.items = {}   # id: Item
+		self.next_id = 0
+		self.top = 0      # pixel y of the top of the view
+
+	def count(self, name):
+		CALLS[name] += 1
+
+	def find(self, tag_or_id):
+		if isinstance(tag_or_id, int):
+			return [tag_or_id] if tag_or_id in self.items else []
+		if tag_or_id == "all":
+			return list(self.items)
+		return [ident for ident, item in self.items.items() if tag_or_id in item.tags]
+
+	def create(self, kind, coords, options):
+		self.count("create_" + kind)
+		self.next_id += 1
+		self.items[self.next_id] = Item(kind, coords, options)
+		return self.next_id
+
+	def create_text(self, *coords, **options):
+		return self.create("text", coords, options)
+
+	def create_line(self, *coords, **options):
+		return self.create("line", coords, options)
+
+	def create_rectangle(self, *coords, **options):
+		return self.create("rectangle", coords, options)
+
+	def create_window(self, *coords, **options):
+		return self.create("window", coords, options)
+
+	def delete(self, *tags_or_ids):
+		self.count("delete")
+		for tag_or_id in tags_or_ids:
+			for ident in self.find(tag_or_id):
+				del self.items[ident]
+
+	def itemconfig(self, tag_or_id, **options):
+		self.count("itemconfig")
+		for ident in self.find(tag_or_id):
+			self.items[ident].options.update(options)
+
+	itemconfigure = itemconfig
+
+	def coords(self, tag_or_id, *coords):
+		self.count("coords")
+		for ident in self.find(tag_or_id):
+			self.items[ident].coords[:len(coords)] = coords
+
+	def move(self, tag_or_id, dx, dy):
+		self.count("move")
+		for ident in self.find(tag_or_id):
+			coords = self.items[ident].coords
+			coords[0::2] = [x + dx for x in coords[0::2]]
+			coords[1::2] = [y + dy for y in coords[1::2]]
+
+	def moveto(self, tag_or_id, x, y):
+		self.count("moveto")
+		for ident in self.find(tag_or_id):
+			item = self.items[ident]
+			item.coords[0::2] = [x + old - item.coords[0] for old in item.coords[0::2]]
+			item.coords[1::2] = [y + old - item.coords[1] for old in item.coords[1::2]]
+
+	def bbox(self, tag_or_id):
+		self.count("bbox")
+		coords = [self.items[ident].coords for ident in self.find(tag_or_id)]
+		if not coords:
+			return None
+		xs = [x for c in coords for x in c[0::2]]
+		ys = [y for c in coords for y in c[1::2]]
+		return (min(xs), min(ys), max(xs), max(ys))
+
+	def addtag_withtag(self, new_tag, tag_or_id):
+		for ident in self.find(tag_or_id):
+			self.items[ident].tags.add(new_tag)
+
+	def dtag(self, tag_or_id, tag=None):
+		for ident in self.find(tag_or_id):
+			self.items[ident].tags.discard(tag or tag_or_id)
+
+	def canvasx(self, x):
+		return x
+
+	def canvasy(self, y):
+		return y + self.top
+
+	def config(self, **options):
+		super().config(**options)
+		if "scrollregion" in options:
+			self.scrolled()
+
+	configure = config
+
+	def scroll_height(self):
+		region = self.options.get("scrollregion")
+		return max(region[3] - region[1], 1) if region else 1
+
+	def scrolled(self):
+		height = self.scroll_height()
+		self.top = max(0, min(self.top, height - self.options["height"]))
+		command = self.options.get("yscrollcommand")
+		if command is not None:
+			command(*self.yview())
+
+	def xview(self, *args):
+		return (0.0, 1.0)
+
+	def xview_moveto(self, fraction):
+		pass
+
+	def yview(self, *args):
+		if not args:
+			height = self.scroll_height()
+			return (self.top / height, min(1.0, (self.top + self.options["height"]) / height))
+		if args[0] == "moveto":
+			self.yview_moveto(float(args[1]))
+		elif args[0] == "scroll":
+			self.yview_scroll(int(args[1]), args[2])
+
+	def yview_moveto(self, fraction):
+		self.top = fraction * self.scroll_height()
+		self.scrolled()
+
+	def yview_scroll(self, number, what):
+		self.top += number * (self.options["height"] if what == "pages" else 16)
+		self.scrolled()
+
+
+class Font:
+	"""A font with every character 8 pixels wide that counts measure calls"""
+
+	def __init__(self, root=None, **options):
+		self.options = options
+
+	def actual(self):
+		return dict(self.options)
+
+	def measure(self, text):
+		CALLS["measure"] += 1
+		return 8 * len(text)
+
+	def metrics(self, name):
+		return 15
+
+
+class Clipboard:
+	text = ""
+
+	@classmethod
+	def copy(cls, text):
+		cls.text = text
+
+	@classmethod
+	def paste(cls):
+		return cls.text
+
+
+class FileDialogs:
+	filename = ""
+
+	@classmethod
+	def askopenfilename(cls, **options):
+		return cls.filename
+
+	@classmethod
+	def asksaveasfilename(cls, **options):
+		return cls.filename
+
+
+def install(state_directory):
+	"""Replace Tk in the editor with the stand-ins and keep its journals and
+	session in state_directory"""
+
+	for name in ("Tk", "Frame", "Button", "Menu", "Toplevel", "Label", "Entry", "Checkbutton"):
+		setattr(text_editor, name, Widget)
+	text_editor.BooleanVar = text_editor.StringVar = Variable
+	text_editor.Canvas = Canvas
+	text_editor.Scrollbar = Scrollbar
+	text_editor.tkFont = type("tkFont", (), {"Font": Font})
+	text_editor.clipboard = lambda: Clipboard
+	text_editor.file_dialogs = lambda: FileDialogs
+	Journal.directory = os.path.join(state_directory, "journal")
+	Session.path = os.path.join(state_directory, "session.json")
+
+
+def document(lines):
+	return "\n".join(f"line {n} of the document, some words to draw" for n in range(lines))
+
+
+def open_editor(engine, lines):
+	"""Return an editor with a document of lines lines, scrolled to its
+	middle with the cursor there"""
+
+	editor = text_editor.TextEditor(text_class=ENGINES[engine])
+	tab = editor.current_tab
+	tab.text.set_text(document(lines))
+	tab.text.cursor = [10, lines // 2]
+	tab.redraw()
+	tab.mark_dirty(cursor=True, scroll=True, viewport=True)
+	LOOP.update()
+	return editor
+
+
+def record(action):
+	"""Return the calls made by action and drawing what it changed"""
+
+	CALLS.clear()
+	action()
+	LOOP.update()
+	return Counter(CALLS)
+
+
+# each scenario makes its edits to an editor and returns the most calls one
+# of them made
+
+
+def worst(editor, actions):
+	calls = Counter()
+	for action in actions:
+		calls |= record(action)
+	return calls
+
+
+def key_press(editor):
+	tab = editor.current_tab
+	return worst(editor, [lambda: tab.key_press(DummyEvent(char="a"))] * 20)
+
+
+def enter_key(editor):
+	tab = editor.current_tab
+	return worst(editor, [tab.enter_key] * 20)
+
+
+def ctrl_v(editor):
+	tab = editor.current_tab
+	Clipboard.copy(document(50))
+	return worst(editor, [tab.ctrl_v] * 5)
+
+
+def delete_selection(editor):
+	tab = editor.current_tab
+
+	def delete():
+		y = tab.text.y
+		tab.selection = Selection(5, y - 25, 5, y + 25)
+		tab.delete_selection()
+	return worst(editor, [delete] * 5)
+
+
+def openfile(editor):
+	tab = editor.current_tab
+	with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+		file.write(tab.text.get_text())
+	try:
+		FileDialogs.filename = file.name
+		return record(editor.openfile)
+	finally:
+		os.remove(file.name)
+
+
+def ctrl_a(editor):
+	tab = editor.current_tab
+	return worst(editor, [tab.ctrl_a] * 5)
+
+
+def mouse_move(editor):
+	"""Drag a selection down from the cursor a line at a time"""
+
+	tab = editor.current_tab
+	top = tab.line_y(tab.text.y) - tab.canvas.canvasy(0) + 2
+	record(lambda: tab.mouse_press(DummyEvent(x=30, y=top)))
+	return worst(editor, [
+		lambda row=row: tab.mouse_move(DummyEvent(x=50, y=top + row * tab.char_height))
+		for row in range(1, 20)
+	])
+
+
+# scenario: (function, bound of each counted call as (calls, calls per row
+# of lines in view)), calls without a bound are not made at all
+SCENARIOS = {
+	"key_press": (key_press, {
+		"create_text": (1, 0), "delete": (2, 0), "moveto": (2, 0), "bbox": (1, 0), "measure": (2, 0)
+	}),
+	"enter_key": (enter_key, {
+		"create_text": (2, 0), "delete": (2, 0), "moveto": (2, 0), "bbox": (1, 0), "measure": (2, 0)
+	}),
+	"ctrl_v": (ctrl_v, {
+		"create_text": (0, 1), "delete": (4, 0), "moveto": (2, 0), "bbox": (1, 0), "measure": (0, 1)
+	}),
+	"delete_selection": (delete_selection, {
+		"create_text": (0, 1), "delete": (4, 0), "moveto": (2, 0), "bbox": (1, 0), "measure": (2, 0)
+	}),
+	"openfile": (openfile, {
+		"create_text": (0, 2), "delete": (4, 0), "moveto": (4, 0), "bbox": (2, 0), "measure": (0, 1)
+	}),
+	"ctrl_a": (ctrl_a, {
+		"create_rectangle": (0, 1), "delete": (2, 0), "moveto": (2, 0), "measure": (0, 1)
+	}),
+	"mouse_move": (mouse_move, {
+		"create_rectangle": (2, 0), "delete": (2, 0), "moveto": (2, 0), "measure": (2, 0)
+	}),
+}
+
+
+def main():
+	parser = ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument(
+		"--sizes",
+		nargs="+",
+		type=int,
+		default=[1_000, 10_000, 100_000],
+		help="lines in each document"
+	)
+	parser.add_argument("--engine", choices=ENGINES, default="deque")
+	parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+	args = parser.parse_args()
+
+	failures = []
+	with tempfile.TemporaryDirectory() as state_directory:
+		install(state_directory)
+		print(f"{'scenario':>16} {'lines':>8} " + " ".join(f"{name:>16}" for name in COUNTED))
+		for name in args.scenarios:
+			scenario, bounds = SCENARIOS[name]
+			for lines in args.sizes:
+				editor = open_editor(args.engine, lines)
+				tab = editor.current_tab
+				rows = tab.view[1] - tab.view[0]
+				calls = scenario(editor)
+				LOOP.update()
+				for tab in editor.tabs.values():
+					tab.journal.discard()
+					tab.journal.close()
+
+				over = []
+				for call in COUNTED:
+					most, per_row = bounds.get(call, (0, 0))
+					if calls[call] > most + per_row * rows:
+						over.append(call)
+				print(
+					f"{name:>16} {lines:>8} "
+					+ " ".join(f"{calls[call]:>16}" for call in COUNTED)
+					+ (f"  over the bounds for {', '.join(over)}" if over else "")
+				)
+				failures.extend(f"{name} {lines} {call}" for call in over)
+
+	if failures:
+		sys.exit(f"{len(failures)} counts are over their bounds")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,95 @@
+"""Measure how long the editor takes to start, from launching the process to
+the first idle event of TextEditor.mainloop, when the first screen has been
+drawn and the editor is ready for input.
+
+Every run starts a new process with an empty home directory so no session or
+journal from real use is restored. Needs a display. Usage:
+
+	python benchmarks/startup.py --runs 10 --budget 400
+"""
+
+from argparse import ArgumentParser, SUPPRESS
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(launched):
+	"""Start the editor and print the seconds since launched at each stage.
+	Run in the child process."""
+
+	sys.path.insert(0, ROOT)
+	import text_editor
+	imported = time.time()
+	editor = text_editor.TextEditor()
+	created = time.time()
+
+	def idle():
+		print(imported - launched, created - launched, time.time() - launched)
+		editor.root.destroy()
+
+	editor.root.after_idle(idle)
+	editor.mainloop()
+
+
+def run():
+	"""Start the editor in a new process and return the seconds to (imported,
+	created, first idle) or None if it failed"""
+
+	with tempfile.TemporaryDirectory() as home:
+		env = dict(os.environ, HOME=home, USERPROFILE=home)
+		launched = time.time()
+		result = subprocess.run(
+			[sys.executable, __file__, "--child", repr(launched)],
+			capture_output=True,
+			text=True,
+			env=env,
+		)
+	if result.returncode != 0:
+		print(result.stderr.strip().splitlines()[-1], file=sys.stderr)
+		return None
+	return tuple(map(float, result.stdout.split()))
+
+
+def main():
+	parser = ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--runs", type=int, default=10)
+	parser.add_argument(
+		"--budget",
+		type=float,
+		help="fail if the median time to the first idle event is over this many ms"
+	)
+	parser.add_argument("--child", help=SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		child(float(args.child))
+		return
+
+	results = []
+	for _ in range(args.runs):
+		result = run()
+		if result is None:
+			sys.exit("the editor failed to start (no display?)")
+		results.append(result)
+
+	print(f"{'stage':>10} {'min':>8} {'median':>8} {'max':>8}")
+	for n, stage in enumerate(("imported", "created", "idle")):
+		times = [result[n] * 1000 for result in results]
+		print(
+			f"{stage:>10} {min(times):>6.1f}ms {statistics.median(times):>6.1f}ms "
+			f"{max(times):>6.1f}ms"
+		)
+
+	median = statistics.median(result[2] for result in results) * 1000
+	if args.budget is not None and median > args.budget:
+		sys.exit(f"median startup {median:.1f}ms is over the budget of {args.budget:g}ms")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,633 @@
+import json
+import os
+import tempfile
+from codecs import getincrementaldecoder
+from collections import namedtuple
+from io import IncrementalNewlineDecoder
+from itertools import islice
+from locale import getpreferredencoding
+from queue import Empty, SimpleQueue
+from threading import Event, Thread
+from time import monotonic, perf_counter
+from uuid import uuid4
+
+try:
+	import fcntl
+except ImportError:   # Windows
+	fcntl = None
+	import msvcrt
+
+
+__all__ = [
+	"FileLoader",
+	"FileSaver",
+	"Journal",
+	"Recovered",
+	"Session",
+]
+
+
+# where the editor keeps the journals of unsaved changes and the last session
+STATE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".text_editor")
+
+
+# the umask can only be read by setting it, so it is read once on import
+# rather than on a thread that is saving
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _fingerprint(filename):
+	"""Return the size and modification time of a file, which change when it
+	is replaced"""
+
+	stat = os.stat(filename)
+	return [stat.st_size, stat.st_mtime_ns]
+
+
+def _remove(paths):
+	"""Delete the files that exist of paths"""
+
+	for path in paths:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+
+def _lock(filename):
+	"""Open and lock a file without waiting. Return the open file, which
+	holds the lock until it is closed or the process ends, or None if another
+	process holds the lock."""
+
+	file = open(filename, "a+b")
+	try:
+		if fcntl is not None:
+			fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+		else:
+			file.seek(0)
+			msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+	except OSError:
+		file.close()
+		return None
+	return file
+
+
+class FileLoader:
+	"""Reads a file into a TextArray a chunk at a time.
+
+	The first chunk is read straight away so that the first screen can be
+	drawn. The rest is read and decoded on another thread and added to the
+	end of the text by polling a queue with widget.after, so the lines that
+	have loaded can be scrolled and edited while the rest loads. on_chunk,
+	on_done and on_error are always called on the Tk thread. None of them are
+	called after cancel. If the rest of the file can not be read or decoded
+	on_error is called with the OSError or UnicodeDecodeError instead of
+	on_done, and the text only holds the part of the file before it."""
+
+	first_size = 1 << 16   # bytes read before the first screen is drawn
+	chunk_size = 1 << 18   # bytes read at a time after that
+	poll_interval = 30     # ms between checks of the queue
+	poll_budget = 0.02     # seconds spent adding chunks to the text per poll
+
+	def __init__(self, widget, text_array, filename, on_chunk, on_done, on_error):
+		"""Replace the text with the start of the file. Raises OSError if it
+		can not be opened and UnicodeDecodeError if its start can not be
+		decoded."""
+
+		self.widget = widget
+		self.text_array = text_array
+		self.on_chunk = on_chunk
+		self.on_done = on_done
+		self.on_error = on_error
+
+		self.file = open(filename, "rb")
+		self.size = os.fstat(self.file.fileno()).st_size
+		self.loaded = 0   # bytes that have been added to the text
+		# decodes the same way as open(filename, "r")
+		self.decoder = IncrementalNewlineDecoder(
+			getincrementaldecoder(getpreferredencoding(False))(),
+			translate=True
+		)
+		try:
+			data = self.file.read(self.first_size)
+			text = self.decoder.decode(data, final=not data)
+		except ValueError:
+			self.file.close()
+			raise
+		self.loaded = len(data)
+		text_array.set_text(text)
+
+		self.cancelled = Event()
+		self.done = False
+		self.error = None   # passed to on_error once the loader is done
+		self.queue = SimpleQueue()
+		self.after_id = widget.after(self.poll_interval, self.poll)
+		Thread(target=self.run, daemon=True).start()
+
+	@property
+	def progress(self) -> float:
+		"""The fraction of the file that has been added to the text"""
+
+		return self.loaded / self.size if self.size else 1.0
+
+	def run(self):
+		"""Read and decode the rest of the file, runs on the worker thread"""
+
+		try:
+			with self.file:
+				while not self.cancelled.is_set():
+					data = self.file.read(self.chunk_size)
+					self.queue.put((len(data), self.decoder.decode(data, final=not data)))
+					if not data:
+						break
+		except (OSError, ValueError) as error:  # UnicodeDecodeError is a ValueError
+			self.queue.put(error)
+		self.queue.put(None)   # the file is finished
+
+	def poll(self):
+		"""Add the chunks in the queue to the end of the text"""
+
+		self.after_id = None
+		if self.cancelled.is_set():
+			return
+		line_number = len(self.text_array) - 1
+		chunks = added = 0
+		deadline = perf_counter() + self.poll_budget
+		while perf_counter() < deadline:
+			try:
+				chunk = self.queue.get_nowait()
+			except Empty:
+				break
+			if chunk is None:
+				self.done = True
+				break
+			if isinstance(chunk, Exception):
+				self.error = chunk
+				continue
+			size, text = chunk
+			self.loaded += size
+			added += self.text_array.append_text(text)
+			chunks += 1
+
+		if chunks:
+			self.on_chunk(line_number, added)
+		if self.done:
+			if self.error is None:
+				self.on_done()
+			else:
+				self.on_error(self.error)
+		else:
+			self.after_id = self.widget.after(self.poll_interval, self.poll)
+
+	@property
+	def running(self) -> bool:
+		return not (self.done or self.cancelled.is_set())
+
+	def cancel(self):
+		"""Stop reading the file, on_chunk and on_done will not be called
+		again"""
+
+		self.cancelled.set()
+		if self.after_id is not None:
+			self.widget.after_cancel(self.after_id)
+			self.after_id = None
+
+
+class FileSaver:
+	"""Writes a snapshot of a TextArray to a file on another thread.
+
+	The lines are written a batch at a time to a temporary file in the same
+	directory, which is synced to the disk and then renamed over the file. The
+	file is either left as it was or replaced by the whole text, even if the
+	editor is closed while it is saving. on_done is called on the Tk thread
+	with None or the OSError or UnicodeEncodeError that stopped the save."""
+
+	batch_lines = 1000    # lines joined and written at once
+	poll_interval = 30    # ms between checks of whether the save is done
+
+	def __init__(self, widget, text_array, filename, on_done, before_replace=None):
+		"""before_replace is called on the worker thread with the size and
+		modification time the file will have, once it has been written and
+		before it replaces the file."""
+
+		self.widget = widget
+		self.snapshot = text_array.snapshot()
+		self.filename = filename
+		self.on_done = on_done
+		self.before_replace = before_replace
+
+		self.done = False
+		self.queue = SimpleQueue()
+		self.after_id = widget.after(self.poll_interval, self.poll)
+		Thread(target=self.run, daemon=True).start()
+
+	def run(self):
+		"""Write the file, runs on the worker thread"""
+
+		directory = os.path.dirname(os.path.abspath(self.filename))
+		try:
+			fd, temp = tempfile.mkstemp(
+				dir=directory,
+				prefix=f".{os.path.basename(self.filename)}.",
+				suffix=".tmp"
+			)
+		except OSError as error:
+			self.queue.put(error)
+			return
+		try:
+			with open(fd, "w") as file:
+				os.chmod(temp, _file_mode(self.filename))
+				lines = self.snapshot.iter_lines()
+				separator = ""
+				while batch := list(islice(lines, self.batch_lines)):
+					file.write(separator)
+					file.write("\n".join(batch))
+					separator = "\n"
+				file.flush()
+				os.fsync(file.fileno())
+			if self.before_replace is not None:
+				self.before_replace(_fingerprint(temp))
+			os.replace(temp, self.filename)
+		except (OSError, ValueError) as error:  # text the encoding can not encode
+			try:
+				os.remove(temp)
+			except OSError:
+				pass
+			self.queue.put(error)
+		else:
+			self.queue.put(None)
+
+	def poll(self):
+		"""Call on_done once the file has been written"""
+
+		try:
+			error = self.queue.get_nowait()
+		except Empty:
+			self.after_id = self.widget.after(self.poll_interval, self.poll)
+			return
+		self.after_id = None
+		self.done = True
+		self.on_done(error)
+
+	@property
+	def running(self) -> bool:
+		return not self.done
+
+
+def _file_mode(filename):
+	"""Return the permissions to give a file when it is saved, those of the
+	file it replaces or the default for new files"""
+
+	try:
+		return os.stat(filename).st_mode & 0o7777
+	except OSError:
+		return 0o666 & ~_umask
+
+
+# a tab's journal read back after the editor was killed. base is the file the
+# changes are made to and filename is the file the tab was saving to. lock
+# keeps other editors from recovering it too.
+Recovered = namedtuple("Recovered", ["name", "base", "filename", "changes", "segment", "lock"])
+
+
+class Journal:
+	"""An append only log of the changes made to a tab's text since its file
+	was last saved, so that they can be replayed onto the file if the editor
+	is killed.
+
+	Changes are collected on the Tk thread and written in a batch every
+	flush_interval ms by a worker thread, which syncs the file to the disk at
+	most once every sync_interval seconds. The log is split into segments,
+	a new one is started when a save starts and the ones before it are
+	deleted once the save has replaced the file. Segments are only created
+	once there is a change to write to them.
+
+	Before a save replaces the file it writes a marker with the size and
+	modification time of the new file, so the segments before the save are
+	not replayed onto the saved file if the editor is killed before they are
+	deleted. The editor writing a journal holds a lock on its lock file so
+	that another editor that is running does not recover it."""
+
+	directory = os.path.join(STATE_DIRECTORY, "journal")
+	flush_interval = 200   # ms between writing batches of changes
+	sync_interval = 1.0    # seconds between syncs to the disk
+
+	def __init__(self, widget, filename=None, name=None, segment=0, lock=None):
+		self.widget = widget
+		self.filename = filename
+		self.name = name or uuid4().hex
+		self.oldest = 0           # the oldest segment that may exist
+		self.segment = segment    # the segment that changes are written to
+		self.pending = []         # changes that have not been written
+		self.after_id = None
+		self.queue = None
+		self.thread = None
+		self.lock = lock   # the open lock file, taken by the worker thread
+		self.discarded = False
+
+	def path(self, segment):
+		return os.path.join(self.directory, f"{self.name}.{segment}.journal")
+
+	def marker(self, segment):
+		"""The path of the marker of a save that makes the segments before
+		segment part of the file"""
+
+		return os.path.join(self.directory, f"{self.name}.{segment}.saved")
+
+	def record(self, change):
+		"""Add a change to the next batch"""
+
+		self.pending.append(json.dumps(change, separators=(",", ":")))
+		if self.after_id is None:
+			self.after_id = self.widget.after(self.flush_interval, self.flush)
+
+	def flush(self):
+		"""Send the pending changes to the worker thread. A flush that was
+		scheduled finds nothing to send if this is called before it."""
+
+		self.after_id = None
+		if not self.pending:
+			return
+		header = json.dumps({"filename": self.filename})
+		self.pending.append("")   # end the last change with a newline
+		self.send(("write", self.path(self.segment), header, "\n".join(self.pending)))
+		self.pending = []
+
+	def checkpoint(self, filename):
+		"""Start a new segment for the changes made after a save of filename
+		starts. Return (before_replace, replaced) for the save to call.
+		before_replace writes the marker of the save on the save's worker
+		thread and replaced deletes the older segments and the marker once the
+		save is done, on the Tk thread."""
+
+		self.flush()
+		old = [self.path(n) for n in range(self.oldest, self.segment + 1)]
+		self.segment += 1
+		self.filename = filename
+		marker = self.marker(self.segment)
+
+		def before_replace(fingerprint):
+			try:
+				os.makedirs(self.directory, exist_ok=True)
+				with open(marker, "w", encoding="utf-8") as file:
+					json.dump({"filename": filename, "fingerprint": fingerprint}, file)
+					file.flush()
+					os.fsync(file.fileno())
+			except OSError:
+				pass   # the journal is best effort, the save goes on without it
+
+		def replaced():
+			if self.discarded:
+				# the tab was closed, so there is no worker thread to do it
+				try:
+					_remove(old + [marker])
+				except OSError:
+					pass
+			else:
+				self.send(("remove", old + [marker]))
+		return before_replace, replaced
+
+	def saved(self, segment):
+		"""Record that the segments before segment have been deleted"""
+
+		self.oldest = max(self.oldest, segment)
+
+	def restart(self, filename):
+		"""Forget every change, the text has been replaced by filename"""
+
+		self.pending = []
+		self.send(("remove", [self.path(n) for n in range(self.oldest, self.segment + 1)]))
+		self.segment += 1
+		self.oldest = self.segment
+		self.filename = filename
+
+	def discard(self):
+		"""Delete the journal and its lock file, the tab has been closed"""
+
+		self.restart(None)
+		self.close()
+		self.discarded = True
+		if self.lock is not None:
+			try:
+				os.remove(self.lock.name)
+			except OSError:
+				pass
+			self.lock = None
+
+	def close(self):
+		"""Write the pending changes, wait for the worker thread to sync them
+		and stop, and let another editor recover the journal"""
+
+		self.flush()
+		if self.thread is not None:
+			self.queue.put(None)
+			self.thread.join()
+			self.queue = self.thread = None
+		if self.lock is not None:
+			self.lock.close()
+
+	def send(self, command):
+		"""Pass a command to the worker thread, starting it if it is not
+		running"""
+
+		if self.thread is None:
+			self.queue = SimpleQueue()
+			self.thread = Thread(target=self.run, args=(self.queue,), daemon=True)
+			self.thread.start()
+		self.queue.put(command)
+
+	def run(self, queue):
+		"""Carry out the commands from the Tk thread, runs on the worker
+		thread"""
+
+		self.file = None   # the segment being written to
+		self.synced = True
+		self.last_sync = monotonic()
+		if self.lock is None or self.lock.closed:
+			try:
+				os.makedirs(self.directory, exist_ok=True)
+				self.lock = _lock(os.path.join(self.directory, f"{self.name}.lock"))
+			except OSError:
+				pass
+		while True:
+			timeout = None
+			if not self.synced:
+				timeout = max(self.last_sync + self.sync_interval - monotonic(), 0)
+			try:
+				command = queue.get(timeout=timeout)
+			except Empty:
+				command = ("sync",)
+
+			try:
+				if command is None:
+					self._close_segment()
+					return
+				if command[0] == "write":
+					self._write(*command[1:])
+				elif command[0] == "remove":
+					if self.file is not None and self.file.name in command[1]:
+						self.file.close()   # no need to sync what is deleted
+						self.file = None
+						self.synced = True
+					_remove(command[1])
+				if not self.synced and monotonic() - self.last_sync >= self.sync_interval:
+					self._sync()
+			except OSError:
+				# the journal is best effort, editing goes on without it
+				self.file = None
+				self.synced = True
+
+	def _write(self, path, header, data):
+		"""Append data to a segment, starting it with header if it is new"""
+
+		if self.file is not None and self.file.name != path:
+			self._close_segment()
+		if self.file is None:
+			os.makedirs(self.directory, exist_ok=True)
+			self.file = open(path, "a", encoding="utf-8")
+			if not self.file.tell():
+				self.file.write(header + "\n")
+		self.file.write(data)
+		self.file.flush()
+		self.synced = False
+
+	def _sync(self):
+		os.fsync(self.file.fileno())
+		self.synced = True
+		self.last_sync = monotonic()
+
+	def _close_segment(self):
+		if self.file is None:
+			return
+		if not self.synced:
+			self._sync()
+		self.file.close()
+		self.file = None
+
+	@classmethod
+	def recover(cls):
+		"""Return a Recovered for each journal left by an editor that did not
+		close its tabs and is no longer running. The changes are (inserted, x,
+		y, text) tuples. A change that was only partly written when the editor
+		was killed ends the changes. The segments of a save that replaced its
+		file are deleted rather than recovered."""
+
+		try:
+			names = os.listdir(cls.directory)
+		except FileNotFoundError:
+			return []
+		segments = {}   # journal name: segment numbers
+		markers = {}    # journal name: segment numbers of save markers
+		locked = set()  # journal names with a lock file
+		for entry in names:
+			name, _, rest = entry.partition(".")
+			segment, _, extension = rest.partition(".")
+			if segment.isdigit() and extension in ("journal", "saved"):
+				found = segments if extension == "journal" else markers
+				found.setdefault(name, []).append(int(segment))
+			elif rest == "lock":
+				locked.add(name)
+
+		recovered = []
+		for name in segments.keys() | markers.keys() | locked:
+			path = os.path.join(cls.directory, f"{name}.lock")
+			try:
+				lock = _lock(path)
+			except OSError:
+				continue
+			if lock is None:
+				continue   # the editor writing it is running
+
+			first = cls._saved_up_to(name, markers.get(name, ()))
+			superseded = [
+				os.path.join(cls.directory, f"{name}.{n}.journal")
+				for n in segments.get(name, ()) if n < first
+			]
+			superseded.extend(
+				os.path.join(cls.directory, f"{name}.{n}.saved")
+				for n in markers.get(name, ()) if n <= first
+			)
+			for superseded_path in superseded:
+				try:
+					os.remove(superseded_path)
+				except OSError:
+					pass
+			numbers = sorted(n for n in segments.get(name, ()) if n >= first)
+			if not numbers:
+				lock.close()
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+				continue
+
+			base = filename = None
+			changes = []
+			for n, segment in enumerate(numbers):
+				path = os.path.join(cls.directory, f"{name}.{segment}.journal")
+				with open(path, encoding="utf-8") as file:
+					lines = file.read().split("\n")
+				try:
+					filename = json.loads(lines[0])["filename"]
+					if not n:
+						base = filename
+					for line in lines[1:-1]:
+						changes.append(tuple(json.loads(line)))
+				except (ValueError, KeyError, TypeError):
+					break
+				if lines[-1]:
+					break   # the editor was killed while writing this segment
+			recovered.append(Recovered(name, base, filename, changes, numbers[-1], lock))
+		return recovered
+
+	@classmethod
+	def _saved_up_to(cls, name, markers):
+		"""Return the first segment that is not part of the file, from the
+		newest save marker whose file is the one it describes, or 0"""
+
+		for segment in sorted(markers, reverse=True):
+			path = os.path.join(cls.directory, f"{name}.{segment}.saved")
+			try:
+				with open(path, encoding="utf-8") as file:
+					saved = json.load(file)
+				if _fingerprint(saved["filename"]) == saved["fingerprint"]:
+					return segment
+			except (OSError, ValueError, KeyError, TypeError):
+				continue
+		return 0
+
+
+class Session:
+	"""The tabs that were open when the editor was last closed, saved as JSON.
+
+	Each tab is a dict of its "filename", the name of the "journal" of its
+	unsaved changes, its "cursor", its "scroll" position as fractions of the
+	width and height of its text and whether it was the "current" tab."""
+
+	path = os.path.join(STATE_DIRECTORY, "session.json")
+
+	@classmethod
+	def load(cls):
+		"""Return the tabs of the last session or [] if there is not one"""
+
+		try:
+			with open(cls.path, encoding="utf-8") as file:
+				tabs = json.load(file)["tabs"]
+		except (OSError, ValueError, KeyError, TypeError):
+			return []
+		return [tab for tab in tabs if isinstance(tab, dict)]
+
+	@classmethod
+	def save(cls, tabs):
+		"""Replace the last session. It is kept if the new one can not be
+		written."""
+
+		temp = cls.path + ".tmp"
+		try:
+			os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+			with open(temp, "w", encoding="utf-8") as file:
+				json.dump({"tabs": tabs}, file)
+			os.replace(temp, cls.path)
+		except OSError:
+			pass
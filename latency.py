@@ -0,0 +1,177 @@
+import json
+import sys
+import traceback
+from bisect import bisect_right
+from collections import deque
+from threading import Event, Thread, get_ident
+from time import perf_counter
+
+
+__all__ = [
+	"Histogram",
+	"Latency",
+]
+
+
+class Histogram:
+	"""Counts of how long something took in ms, in buckets that double in
+	size so that adding a time is cheap however many are added"""
+
+	bounds = tuple(2 ** n / 4 for n in range(14))   # 0.25 ms to 2048 ms
+
+	def __init__(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, ms):
+		self.counts[bisect_right(self.bounds, ms)] += 1
+		self.count += 1
+		self.total += ms
+		if ms > self.max:
+			self.max = ms
+
+	def percentile(self, fraction):
+		"""Return the upper bound of the bucket that the fraction of the times
+		are in, or the longest time if it is smaller"""
+
+		seen = 0
+		for bound, count in zip(self.bounds, self.counts):
+			seen += count
+			if seen >= fraction * self.count:
+				return min(bound, self.max)
+		return self.max
+
+	def as_dict(self):
+		"""Return the histogram as a dict that can be written as JSON"""
+
+		buckets = {f"<{bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+		buckets[f">={self.bounds[-1]:g}"] = self.counts[-1]
+		return {
+			"count": self.count,
+			"mean_ms": self.total / self.count if self.count else 0.0,
+			"p50_ms": self.percentile(0.5),
+			"p99_ms": self.percentile(0.99),
+			"max_ms": self.max,
+			"buckets": buckets,
+		}
+
+
+class Latency:
+	"""Times event handlers into a Histogram for each handler.
+
+	A watchdog thread checks on the handler that is running every
+	threshold / 2 ms. Once a handler has run for over threshold ms it samples
+	the stack of the thread running it, so the slow part of a handler can be
+	found after the handler has returned. The watchdog is started by the
+	first timed call."""
+
+	threshold = 100   # ms a handler can run before its stack is sampled
+	kept_samples = 20
+
+	def __init__(self):
+		self.histograms = {}   # handler name: Histogram
+		self.samples = deque(maxlen=self.kept_samples)
+		self.running = None    # (handler name, start, thread id) of the timed call running
+		self.sampled = (None, None)   # the running tuple and sample of the last call sampled
+		self.watchdog = None
+		self.stopped = Event()
+
+	def timed(self, name, handler):
+		"""Return a function that calls handler and adds how long it took to
+		the histogram of name"""
+
+		histogram = self.histograms.setdefault(name, Histogram())
+
+		def timed_handler(*args):
+			if self.watchdog is None:
+				self.start_watchdog()
+			outer = self.running
+			start = perf_counter()
+			running = self.running = (name, start, get_ident())
+			try:
+				return handler(*args)
+			finally:
+				ms = (perf_counter() - start) * 1000
+				self.running = outer
+				histogram.add(ms)
+				sampled_call, sample = self.sampled
+				if sampled_call is running:
+					sample["ms"] = ms
+		return timed_handler
+
+	def bind(self, widget):
+		"""Return a function like widget.bind that times the handlers it binds
+		by their names"""
+
+		def bind(sequence, handler):
+			return widget.bind(sequence, self.timed(handler.__name__, handler))
+		return bind
+
+	def start_watchdog(self):
+		self.watchdog = Thread(target=self.watch, daemon=True)
+		self.watchdog.start()
+
+	def watch(self):
+		"""Sample the stack of each call that runs for over threshold ms.
+		Run on the watchdog thread."""
+
+		while not self.stopped.wait(self.threshold / 2000):
+			running = self.running
+			if (
+				running is None
+				or running is self.sampled[0]
+				or (perf_counter() - running[1]) * 1000 < self.threshold
+			):
+				continue
+			frame = sys._current_frames().get(running[2])
+			if frame is None:
+				continue
+			sample = {
+				"handler": running[0],
+				"ms": None,   # filled in when the call returns
+				"stack": traceback.format_stack(frame),
+			}
+			self.sampled = (running, sample)
+			self.samples.append(sample)
+
+	def stop(self):
+		self.stopped.set()
+
+	def as_dict(self):
+		"""Return the histograms of the handlers that have been called and the
+		stacks sampled from slow calls as a dict that can be written as JSON"""
+
+		return {
+			"threshold_ms": self.threshold,
+			"handlers": {
+				name: histogram.as_dict()
+				for name, histogram in sorted(self.histograms.items())
+				if histogram.count
+			},
+			"slow_calls": list(self.samples),
+		}
+
+	def dump(self, filename):
+		"""Write the histograms and samples to a JSON file"""
+
+		with open(filename, "w") as file:
+			json.dump(self.as_dict(), file, indent="\t")
+
+	def summary(self):
+		"""Return a line of text for each handler that has been called, the
+		slowest first"""
+
+		histograms = sorted(
+			((name, histogram) for name, histogram in self.histograms.items() if histogram.count),
+			key=lambda item: item[1].max,
+			reverse=True
+		)
+		lines = [f"{'handler':<16}{'count':>7}{'p50':>8}{'p99':>8}{'max':>8}"]
+		for name, histogram in histograms:
+			lines.append(
+				f"{name:<16}{histogram.count:>7}{histogram.percentile(0.5):>6.1f}ms"
+				f"{histogram.percentile(0.99):>6.1f}ms{histogram.max:>6.1f}ms"
+			)
+		return "\n".join(lines)
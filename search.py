@@ -0,0 +1,438 @@
+import re
+from array import array
+from queue import Empty, SimpleQueue
+from threading import Event, Thread
+from bisect import bisect_right
+from itertools import accumulate, islice
+from time import perf_counter
+
+from DataStructures import Point, Selection
+
+
+__all__ = [
+	"MatchIndex",
+	"RegexProcess",
+	"Search",
+	"SearchTimeout",
+	"SearchWorker",
+]
+
+
+class SearchTimeout(Exception):
+	"""Raised when a search runs for longer than its time budget"""
+
+
+def _find(pattern, texts, anchored, replace):
+	"""Return a list of the (start, end, replace(match)) of the non-empty
+	matches in each (text, pos) in texts. Only the match at pos is found if
+	anchored."""
+
+	results = []
+	for text, pos in texts:
+		found = (pattern.match(text, pos),) if anchored else pattern.finditer(text, pos)
+		results.append([
+			(match.start(), match.end(), replace(match))
+			for match in found
+			if match is not None and match.end() > match.start()
+		])
+	return results
+
+
+def _serve(connection):
+	"""Answer the requests of a RegexProcess until it is closed, runs in the
+	child process"""
+
+	patterns = {}   # regular expression: compiled pattern
+	connection.send(None)   # started
+	while True:
+		try:
+			find_text, template, anchored, texts = connection.recv()
+		except EOFError:
+			return
+		if find_text not in patterns:
+			patterns[find_text] = re.compile(find_text, re.MULTILINE)
+		if template is None:
+			replace = lambda match: None
+		else:
+			replace = lambda match: match.expand(template)
+		try:
+			connection.send((None, _find(patterns[find_text], texts, anchored, replace)))
+		except (re.error, IndexError) as error:   # the template is not valid
+			connection.send((error, None))
+
+
+class RegexProcess:
+	"""A child process that matches regular expressions.
+
+	Python can not interrupt a regular expression while it is matching one
+	string, so one that backtracks for too long can only be stopped by
+	killing the process running it. The process is started by the first
+	request and started again by the request after it is killed."""
+
+	wait_interval = 0.05   # seconds between checks of the deadline
+
+	def __init__(self):
+		self.process = None
+		self.connection = None
+		self.started = False   # whether the process is ready for requests
+
+	def start(self):
+		# multiprocessing is imported by the first regex search rather than
+		# when the editor starts
+		import multiprocessing
+
+		context = multiprocessing.get_context()
+		self.connection, child = context.Pipe()
+		self.process = context.Process(target=_serve, args=(child,), daemon=True)
+		self.process.start()
+		child.close()
+		self.started = False
+
+	def run(self, find_text, template, anchored, texts, deadline=None):
+		"""Return the _find results of the regular expression find_text on
+		texts with replacements from template, or None for each replacement
+		if template is None. The time the process takes to start is not
+		counted against the deadline.
+
+		Raises SearchTimeout and kills the process if it does not answer by
+		the deadline, re.error or IndexError if template is not valid and
+		EOFError if the process was killed by kill."""
+
+		if self.process is None:
+			self.start()
+		if not self.started:
+			self.connection.recv()
+			self.started = True
+		self.connection.send((find_text, template, anchored, texts))
+		while not self.connection.poll(
+			self.wait_interval if deadline is None
+			else max(min(self.wait_interval, deadline - perf_counter()), 0)
+		):
+			if deadline is not None and perf_counter() > deadline:
+				self.stop()
+				raise SearchTimeout
+		error, results = self.connection.recv()
+		if error is not None:
+			raise error
+		return results
+
+	def kill(self):
+		"""Stop the request that is running, can be called from any thread"""
+
+		process = self.process
+		if process is not None:
+			process.kill()
+
+	def stop(self):
+		"""Kill the process and wait for it to end"""
+
+		if self.process is not None:
+			self.process.kill()
+			self.process.join()
+			self.connection.close()
+			self.process = self.connection = None
+
+
+class Search:
+	"""A literal or regular expression search over the lines of a TextArray
+	that never joins the whole text into one string.
+
+	Patterns without a newline in them are matched against one line at a time,
+	so like grep, "\\s" and "[^a]" do not match across lines. Patterns with a
+	newline are matched against chunks of lines that overlap, a match can span
+	up to max_lines lines.
+
+	Regular expressions are matched in a RegexProcess chunk_lines lines at a
+	time, and it is killed when the time budget runs out, so the budget also
+	stops a pattern that is slow on a single line. Literal text can not be
+	slow, it is matched in this process and the budget is checked between
+	lines and chunks."""
+
+	chunk_lines = 1000   # lines matched at once for patterns with newlines and regexes
+	max_lines = 100      # lines a regular expression match can span
+	check_every = 256    # lines between checks of the time budget
+	process = RegexProcess()   # runs the regexes of the searches on the Tk thread
+
+	def __init__(self, find_text, regex=False, budget=None):
+		"""Raises re.error if find_text is not a valid regular expression"""
+
+		self.find_text = find_text
+		self.regex = regex
+		self.budget = budget
+		if regex:
+			self.pattern = re.compile(find_text, re.MULTILINE)
+			self.multiline = "\n" in find_text or "\\n" in find_text
+			self.overlap = self.max_lines
+		else:
+			self.pattern = re.compile(re.escape(find_text))
+			self.multiline = "\n" in find_text
+			self.overlap = find_text.count("\n")
+
+	@property
+	def key(self):
+		"""What the search finds, two searches with the same key find the same
+		matches"""
+
+		return (self.find_text, self.regex)
+
+	def matches(self, lines, start=0, template=None):
+		"""Yield (start, end, replacement) for every match in lines, an
+		iterable of the lines of the text starting at line number start.
+		Empty matches are skipped. replacement is the text to replace the
+		match with if a template is given, see replacement_at, or None.
+
+		Raises SearchTimeout if the time budget runs out and re.error or
+		IndexError if template is not valid."""
+
+		deadline = None if self.budget is None else perf_counter() + self.budget
+		if self.multiline:
+			return self._chunk_matches(iter(lines), start, deadline, template)
+		if self.regex:
+			return self._regex_line_matches(iter(lines), start, deadline, template)
+		return self._line_matches(lines, start, deadline, template)
+
+	def _find(self, texts, template, deadline, anchored=False):
+		"""Return the _find results of the pattern on texts, in the
+		RegexProcess if it is a regular expression"""
+
+		if self.regex:
+			return self.process.run(self.find_text, template, anchored, texts, deadline)
+		return _find(self.pattern, texts, anchored, lambda match: template)
+
+	def _line_matches(self, lines, start, deadline, template):
+		"""Match literal text against one line at a time"""
+
+		for y, line in enumerate(lines, start):
+			if deadline is not None and not (y - start) % self.check_every:
+				if perf_counter() > deadline:
+					raise SearchTimeout
+			if self.find_text not in line:
+				continue
+			for match in self.pattern.finditer(line):
+				if match.end() > match.start():
+					yield Point(match.start(), y), Point(match.end(), y), template
+
+	def _regex_line_matches(self, lines, start, deadline, template):
+		"""Match a regular expression against one line at a time, sending
+		chunk_lines lines at once to the RegexProcess"""
+
+		y = start
+		while batch := list(islice(lines, self.chunk_lines)):
+			found = self._find([(line, 0) for line in batch], template, deadline)
+			for line_number, spans in enumerate(found, y):
+				for x1, x2, replacement in spans:
+					yield Point(x1, line_number), Point(x2, line_number), replacement
+			y += len(batch)
+
+	def _chunk_matches(self, lines, start, deadline, template):
+		"""Match against chunk_lines lines at a time with overlap lines from
+		the next chunk added to the end"""
+
+		window = list(islice(lines, self.chunk_lines + self.overlap))
+		first_line = start
+		resume = 0   # matches can not start before the end of the last one
+		while window:
+			if deadline is not None and perf_counter() > deadline:
+				raise SearchTimeout
+
+			text = "\n".join(window)
+			line_starts = list(accumulate(
+				(len(line) + 1 for line in window[:-1]),
+				initial=0
+			))
+			last_window = len(window) <= self.chunk_lines
+			# matches that start after the chunk are found by the next window
+			limit = len(text) + 1 if last_window else line_starts[self.chunk_lines]
+
+			for match_start, match_end, replacement in self._find(
+				[(text, resume)], template, deadline
+			)[0]:
+				if match_start >= limit:
+					break
+				resume = match_end
+				yield (
+					_point(line_starts, match_start, first_line),
+					_point(line_starts, match_end, first_line),
+					replacement,
+				)
+
+			if last_window:
+				return
+			resume = max(resume - limit, 0)
+			window = window[self.chunk_lines:] + list(islice(lines, self.chunk_lines))
+			first_line += self.chunk_lines
+
+	def replacement_at(self, text_array, selection, template):
+		"""Return the text to replace the match that covers exactly the
+		selection with or None if there is not one, which happens when the
+		text has been edited since the match was found. Regular expression
+		templates can refer to groups the same way as re.sub.
+
+		Raises SearchTimeout if the time budget runs out and re.error or
+		IndexError if template is not valid."""
+
+		point = selection.start
+		if self.multiline:
+			lines = list(islice(text_array.iter_lines(point.y), self.overlap + 1))
+		else:
+			lines = [text_array[point.y]]
+		line_starts = list(accumulate((len(line) + 1 for line in lines[:-1]), initial=0))
+		deadline = None if self.budget is None else perf_counter() + self.budget
+		found = self._find([("\n".join(lines), point.x)], template, deadline, anchored=True)[0]
+		if not found or _point(line_starts, found[0][1], point.y) != selection.end:
+			return None
+		return found[0][2]
+
+
+def _point(line_starts, offset, first_line):
+	"""Convert an offset into lines joined by newlines into a Point"""
+
+	i = bisect_right(line_starts, offset) - 1
+	return Point(offset - line_starts[i], first_line + i)
+
+
+class MatchIndex:
+	"""Every match of a Search in a TextArray, found with a single scan of
+	the text. An index made with scan=False starts empty and is filled in by
+	extend as a SearchWorker finds matches."""
+
+	def __init__(self, text_array, search, scan=True):
+		"""Raises SearchTimeout if the search runs out of time"""
+
+		self.key = search.key
+		self.version = text_array.version
+		self.complete = False
+
+		# the start and end of each match
+		self.y1 = array("q")
+		self.x1 = array("q")
+		self.y2 = array("q")
+		self.x2 = array("q")
+		if scan:
+			self.extend(search.matches(text_array.iter_lines()))
+			self.complete = True
+
+	def extend(self, matches):
+		"""Add (start, end, ...) for matches after the last one in the index"""
+
+		for start, end, *_ in matches:
+			self.y1.append(start.y)
+			self.x1.append(start.x)
+			self.y2.append(end.y)
+			self.x2.append(end.x)
+
+	def __len__(self):
+		return len(self.y1)
+
+	def __getitem__(self, n) -> Selection:
+		"""Return a selection of the nth match"""
+
+		return Selection(self.x1[n], self.y1[n], self.x2[n], self.y2[n])
+
+	def is_current(self, text_array, search) -> bool:
+		"""Return whether the index is for this text and search"""
+
+		return self.version == text_array.version and self.key == search.key
+
+
+class SearchWorker:
+	"""Fills a MatchIndex from a snapshot of a TextArray on another thread.
+
+	Matches are passed back in batches through a queue that is polled with
+	widget.after, so on_batch, on_done and on_error are always called on the
+	Tk thread. None of them are called after cancel. If the scan fails
+	on_error is called with the exception instead of on_done, and the index
+	only holds the matches found before it.
+
+	The scan has no time budget. A regular expression is matched in a
+	RegexProcess of the worker's own, which cancel kills."""
+
+	batch_size = 1000    # matches sent back at once
+	poll_interval = 30   # ms between checks of the queue
+
+	def __init__(self, widget, text_array, search, on_batch, on_done, on_error):
+		self.widget = widget
+		self.snapshot = text_array.snapshot()
+		self.search = Search(search.find_text, search.regex)
+		self.search.process = RegexProcess()
+		self.on_batch = on_batch
+		self.on_done = on_done
+		self.on_error = on_error
+		self.index = MatchIndex(self.snapshot, search, scan=False)
+		self.error = None   # passed to on_error once the scan is done
+
+		self.cancelled = Event()
+		self.queue = SimpleQueue()
+		self.after_id = widget.after(self.poll_interval, self.poll)
+		Thread(target=self.run, daemon=True).start()
+
+	def lines(self):
+		"""The lines of the snapshot, stopping early once cancelled"""
+
+		for n, line in enumerate(self.snapshot.iter_lines()):
+			if not n % Search.check_every and self.cancelled.is_set():
+				return
+			yield line
+
+	def run(self):
+		"""Scan the snapshot, runs on the worker thread"""
+
+		batch = []
+		try:
+			for start, end, _ in self.search.matches(self.lines()):
+				batch.append((start, end))
+				if len(batch) >= self.batch_size:
+					self.queue.put(batch)
+					batch = []
+		except Exception as error:
+			self.queue.put(error)
+		finally:
+			self.search.process.stop()
+			self.queue.put(batch)
+			self.queue.put(None)   # the scan is finished
+
+	def poll(self):
+		"""Move the batches in the queue into the index"""
+
+		self.after_id = None
+		if self.cancelled.is_set():
+			return
+		added = done = False
+		while True:
+			try:
+				batch = self.queue.get_nowait()
+			except Empty:
+				break
+			if batch is None:
+				done = True
+				break
+			if isinstance(batch, Exception):
+				self.error = batch
+				continue
+			self.index.extend(batch)
+			added = True
+
+		if added:
+			self.on_batch(self.index)
+		if self.cancelled.is_set():
+			return
+		if done and self.error is not None:
+			self.on_error(self.error)
+		elif done:
+			self.index.complete = True
+			self.on_done(self.index)
+		else:
+			self.after_id = self.widget.after(self.poll_interval, self.poll)
+
+	@property
+	def running(self) -> bool:
+		return not (self.index.complete or self.cancelled.is_set())
+
+	def cancel(self):
+		"""Stop the scan, none of the callbacks will be called again"""
+
+		self.cancelled.set()
+		self.search.process.kill()
+		if self.after_id is not None:
+			self.widget.after_cancel(self.after_id)
+			self.after_id = None
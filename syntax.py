@@ -0,0 +1,226 @@
+import builtins
+import keyword
+import re
+from os.path import splitext
+
+
+__all__ = [
+	"GRAMMARS",
+	"Highlighter",
+	"PythonGrammar",
+]
+
+
+class PythonGrammar:
+	"""Splits lines of Python into colored tokens.
+
+	The state of the lexer between lines is 0 or the quotes of the triple
+	quoted string that the line ends inside of."""
+
+	initial = 0
+
+	keywords = frozenset(keyword.kwlist)
+	builtins = frozenset(name for name in dir(builtins) if not name.startswith("_"))
+	definers = frozenset(("def", "class"))
+
+	pattern = re.compile(r"""
+		(?P<comment>\#.*)
+		|(?P<string>[rRbBuUfF]{0,2}
+			(?:'''|\"\"\"|'(?:[^'\\]|\\.)*'?|"(?:[^"\\]|\\.)*"?))
+		|(?P<decorator>^\s*@[\w.]+)
+		|(?P<number>\b(?:
+			0[xX][\da-fA-F_]+|0[bB][01_]+|0[oO][0-7_]+
+			|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?[jJ]?
+		)\b)
+		|(?P<name>[^\W\d]\w*)
+	""", re.VERBOSE)
+
+	# the rest of a triple quoted string up to and including its end
+	closers = {
+		"'''": re.compile(r"(?:[^\\]|\\.)*?'''"),
+		'"""': re.compile(r'(?:[^\\]|\\.)*?"""'),
+	}
+
+	def lex(self, line, state):
+		"""Return (tokens, state at the end of the line) for a line that starts
+		in the given state. Tokens are (start, end, tag) tuples."""
+
+		tokens = []
+		pos = 0
+		if state:
+			close = self.closers[state].match(line)
+			if close is None:
+				return [(0, len(line), "string")] if line else [], state
+			tokens.append((0, close.end(), "string"))
+			pos = close.end()
+
+		definition = False
+		while (match := self.pattern.search(line, pos)) is not None:
+			tag = match.lastgroup
+			start, pos = match.span()
+			if tag == "string":
+				quote = match.group().lstrip("rRbBuUfF")
+				if quote in self.closers:
+					close = self.closers[quote].match(line, pos)
+					if close is None:
+						tokens.append((start, len(line), "string"))
+						return tokens, quote
+					pos = close.end()
+			elif tag == "decorator":
+				start = line.index("@")
+			elif tag == "name":
+				word = match.group()
+				if definition:
+					tag = "definition"
+				elif word in self.keywords:
+					tag = "keyword"
+				elif word in self.builtins:
+					tag = "builtin"
+				else:
+					tag = None
+				definition = word in self.definers
+			if tag is not None:
+				tokens.append((start, pos, tag))
+		return tokens, self.initial
+
+	def end_state(self, line, state):
+		"""Return the state at the end of a line without finding its tokens"""
+
+		if not state and "'" not in line and '"' not in line:
+			return state  # only quotes can start a string
+		return self.lex(line, state)[1]
+
+
+# grammars to highlight files with by their extension
+GRAMMARS = {
+	".py": PythonGrammar,
+	".pyw": PythonGrammar,
+}
+
+
+class Highlighter:
+	"""Colors the lines of a TextArray with a grammar.
+
+	The state of the lexer at the end of every line that has been lexed is
+	cached. After an edit the lines are lexed again starting at the first
+	edited line only until the state at the end of a line is the same as it
+	was before. Lines after the ones that have been lexed are only lexed when
+	they are drawn."""
+
+	# lines to skip past before they are read in bulk rather than one at a time
+	read_ahead = 1000
+
+	def __init__(self, grammar):
+		self.grammar = grammar
+		self.states = []   # the state at the end of each line that is cached
+		self.first_dirty = None   # range of lines edited since the last update
+		self.last_dirty = None
+
+	@classmethod
+	def for_filename(cls, filename):
+		"""Return a Highlighter for the grammar of the file's extension or None
+		if there is not one"""
+
+		if not filename:
+			return None
+		grammar = GRAMMARS.get(splitext(filename)[1].lower())
+		return None if grammar is None else cls(grammar())
+
+	def edited(self, first, last=None):
+		"""Record that the lines from first to last have changed"""
+
+		if last is None:
+			last = first
+		if self.first_dirty is None:
+			self.first_dirty, self.last_dirty = first, last
+		else:
+			self.first_dirty = min(self.first_dirty, first)
+			self.last_dirty = max(self.last_dirty, last)
+
+	def lines_inserted(self, line_number, count):
+		"""Make room for count new lines after line_number"""
+
+		# the state at the end of line_number belongs to the last new line,
+		# it is the state the line after it started in
+		if line_number < len(self.states):
+			self.states[line_number:line_number] = [None] * count
+		if self.first_dirty is not None:
+			if self.first_dirty > line_number:
+				self.first_dirty += count
+			if self.last_dirty > line_number:
+				self.last_dirty += count
+		self.edited(line_number, line_number + count)
+
+	def lines_removed(self, line_number, count):
+		"""Remove the count lines after line_number"""
+
+		# line_number keeps the state at the end of the last removed line
+		del self.states[line_number:line_number + count]
+		if self.first_dirty is not None:
+			self.first_dirty = _removed(self.first_dirty, line_number, count)
+			self.last_dirty = _removed(self.last_dirty, line_number, count)
+		self.edited(line_number)
+
+	def update(self, text_array, stop):
+		"""Lex the edited lines again and the lines after them until the
+		states converge. Lexing gives up after line stop and forgets the states
+		after it so that they are lexed when they are drawn.
+
+		Return a range of the lines whose colors may have changed."""
+
+		if self.first_dirty is None:
+			return range(0)
+		first, last = self.first_dirty, self.last_dirty
+		self.first_dirty = self.last_dirty = None
+		del self.states[len(text_array):]
+
+		y = first
+		state = self.state_before(text_array, y) if y <= len(self.states) else None
+		while y < len(self.states):
+			end = self.grammar.end_state(text_array[y], state)
+			old = self.states[y]
+			self.states[y] = end
+			if end == old and y >= last:
+				break
+			if y >= stop:
+				del self.states[y + 1:]
+				break
+			state = end
+			y += 1
+		return range(first, y + 1)
+
+	def state_before(self, text_array, line_number):
+		"""Return the state at the start of a line, lexing the lines before it
+		if they have not been lexed"""
+
+		if line_number == 0:
+			return self.grammar.initial
+		state = self.grammar.initial
+		if self.states:
+			state = self.states[min(line_number, len(self.states)) - 1]
+			if state is None:  # the line was inserted since the last update
+				state = self.grammar.initial
+		start = len(self.states)
+		if line_number - start > self.read_ahead:
+			lines = text_array.iter_lines(start)
+		else:
+			lines = (text_array[y] for y in range(start, line_number))
+		for _ in range(start, line_number):
+			state = self.grammar.end_state(next(lines), state)
+			self.states.append(state)
+		return state
+
+	def tokens(self, text_array, line_number):
+		"""Return the (start, end, tag) tokens of a line"""
+
+		state = self.state_before(text_array, line_number)
+		return self.grammar.lex(text_array[line_number], state)[0]
+
+
+def _removed(line_number, start, count):
+	"""Return where a line moves to once the count lines after start are
+	removed"""
+
+	if line_number > start + count:
+		return line_number - count
+	return min(line_number, start)
@@ -0,0 +1,89 @@
+"""Tests of the find window, run without a display by replacing Tk with the
+stand-ins of benchmarks/render_work.py. Usage:
+
+	python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import render_work
+from render_work import LOOP, Variable, Widget
+import text_editor
+
+
+class Entry(Widget):
+	"""An entry box that holds its text"""
+
+	def __init__(self, master=None, textvariable=None, **options):
+		super().__init__(master, **options)
+		self.variable = textvariable if textvariable is not None else Variable(value="")
+
+	def get(self):
+		return self.variable.get()
+
+
+class FindTest(unittest.TestCase):
+	def setUp(self):
+		self.state_directory = tempfile.TemporaryDirectory()
+		render_work.install(self.state_directory.name)
+		text_editor.Entry = Entry
+		self.editor = text_editor.TextEditor()
+		self.tab = self.editor.current_tab
+		self.tab.ctrl_f()
+		self.window = self.tab.find_window
+
+	def tearDown(self):
+		LOOP.update()
+		for tab in self.editor.tabs.values():
+			tab.journal.discard()
+		self.state_directory.cleanup()
+
+	def set_text(self, text):
+		self.tab.text.set_text(text)
+		self.tab.redraw()
+		LOOP.update()
+
+	def press(self, button):
+		"""Press a button of the find window and wait for its search"""
+
+		button["command"]()
+		LOOP.update()
+
+	def test_find_next_without_matches(self):
+		self.set_text("abc\ndef")
+		self.window.entry.variable.set("zzz")
+		self.press(self.window.find_next)
+		self.press(self.window.find_next)
+		self.press(self.window.find_prev)
+		self.assertEqual(self.window.error_label["text"], "Can not find 'zzz'")
+		self.assertIsNone(self.window.selection)
+
+	def test_find_next_after_every_match_is_deleted(self):
+		self.set_text("abc\nabc")
+		self.window.entry.variable.set("abc")
+		self.press(self.window.find_next)
+		self.assertIsNotNone(self.window.selection)
+		self.tab.text.set_text("xyz")
+		self.press(self.window.find_next)
+		self.press(self.window.find_next)
+		self.assertEqual(self.window.error_label["text"], "Can not find 'abc'")
+
+	def test_replace_stale_selection(self):
+		self.set_text("abc f12 xyz")
+		self.window.regex.set(True)
+		self.window.entry.variable.set(r"f(\d+)")
+		self.window.replace_entry.variable.set(r"g\1")
+		self.press(self.window.find_next)
+		self.assertIsNotNone(self.window.selection)
+		self.tab.text.set_text("abc f1 xyz")
+		self.press(self.window.replace_but)
+		self.assertEqual(list(self.tab.text), ["abc f1 xyz"])
+
+
+if __name__ == "__main__":
+	unittest.main()
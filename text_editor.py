@@ -1,34 +1,50 @@
 
 from tkinter import (
 	Tk, Frame, Button, Menu, Canvas, Scrollbar, Toplevel, Label, Entry,
+	Checkbutton, BooleanVar, StringVar,
 )
 import tkinter.font as tkFont
-from tkinter import filedialog as FD
 
+from argparse import ArgumentParser
+from bisect import bisect_left
+from itertools import accumulate, chain
+import re
 from string import printable
-
-import pyperclip
+from time import monotonic
 
 from DataStructures import *
+from files import *
+from latency import *
+from search import *
+from syntax import *
 
 # TODO:
 # highlight current line
 # dark theme
-# undo/redo
 # align text in menu labels
 # variable character width and make tab key work (use binary search to convert canvas coords to index)
 # dont have cursor toggled off while typing
-# find highlights all, but currently selected one is a different color
-# syntax highlighting
-# folding
 # auto indent
 
 
 # INDEFINATE DELAY:
 # bind horizontal scrolling to horizontal scrollbar (no binding for horizontal scrolling on Windows)
 
-# BUGS:
-# holding down keys can cause the screen not to update
+
+def clipboard():
+	"""Return the pyperclip module. It is imported the first time the
+	clipboard is used rather than when the editor starts."""
+
+	import pyperclip
+	return pyperclip
+
+
+def file_dialogs():
+	"""Return tkinter's filedialog module, imported the first time a file
+	dialog is opened"""
+
+	from tkinter import filedialog
+	return filedialog
 
 
 class DummyEvent:
@@ -41,6 +57,57 @@ class DummyEvent:
 		self.__dict__.update(kwargs)
 
 
+class GlyphWidths(dict):
+	"""The width in pixels of each character in a font. Characters are
+	measured the first time they are looked up and the table is shared by
+	everything using the same font."""
+
+	tables = {}
+
+	def __init__(self, font, tab_width):
+		self.font = font
+		self.tab_width = tab_width
+
+	def __missing__(self, char):
+		if char == "\t":
+			width = self[" "] * self.tab_width
+		else:
+			width = self.font.measure(char)
+		self[char] = width
+		return width
+
+	@classmethod
+	def shared(cls, font, tab_width):
+		"""Return the table for the font, creating it if needed"""
+
+		key = (tuple(sorted(font.actual().items())), tab_width)
+		if key not in cls.tables:
+			cls.tables[key] = cls(font, tab_width)
+		return cls.tables[key]
+
+
+class FontMetrics:
+	"""A font and the measurements of it that tabs need. Creating a font and
+	measuring it are round trips to Tk, so there is one for each family and
+	size that every tab shares."""
+
+	shared_metrics = {}
+
+	def __init__(self, root, family, size):
+		self.font = tkFont.Font(root=root, family=family, size=size)
+		self.linespace = self.font.metrics("linespace")
+		self.digit_width = self.font.measure("9")
+
+	@classmethod
+	def shared(cls, root, family, size):
+		"""Return the metrics for the font, creating them if needed"""
+
+		key = (root, family, size)
+		if key not in cls.shared_metrics:
+			cls.shared_metrics[key] = cls(root, family, size)
+		return cls.shared_metrics[key]
+
+
 class FindReplaceWindow:
 	"""Class to create a window for finding and replacing text"""
 
@@ -52,7 +119,8 @@ class FindReplaceWindow:
 		replace,
 		update_cursor,
 		scroll,
-		update_line,
+		replace_ranges,
+		show_matches,
 	):
 		self.root = parent
 		self.text_array = text_array
@@ -60,22 +128,33 @@ class FindReplaceWindow:
 		self.replace = replace
 		self.update_cursor = update_cursor
 		self.scroll = scroll
-		self.update_line = update_line
+		self.replace_ranges = replace_ranges
+		self.show_matches = show_matches
 
 		self.win = Toplevel(self.root)
 		self.win.title("Find")
 
 		self.label = Label(self.win, text="Find:")
-		self.entry = Entry(self.win)
+		self.query = StringVar(self.win)
+		self.query.trace_add("write", self.query_changed)
+		self.entry = Entry(self.win, textvariable=self.query)
+		timed = Tab.latency.timed
 		self.find_prev = Button(
 			self.win,
 			text="▲",
-			command=self.find_next_or_prev(-1)
+			command=timed("find_prev", self.find_next_or_prev(-1))
 		)
 		self.find_next = Button(
 			self.win,
 			text="▼ Find Next",
-			command=self.find_next_or_prev(1)
+			command=timed("find_next", self.find_next_or_prev(1))
+		)
+		self.regex = BooleanVar(self.win)
+		self.regex_check = Checkbutton(
+			self.win,
+			text="Regex",
+			variable=self.regex,
+			command=self.query_changed
 		)
 		self.error_label = Label(self.win, text="")
 
@@ -84,32 +163,68 @@ class FindReplaceWindow:
 		self.entry.grid(row=0, column=1)
 		self.find_prev.grid(row=0, column=2)
 		self.find_next.grid(row=0, column=3)
-		self.error_label.grid(row=2, column=0, columnspan=4)
+		self.regex_check.grid(row=0, column=4)
+		self.error_label.grid(row=2, column=0, columnspan=5)
 
 		self.replace_label = Label(self.win, text="Replace with:")
 		self.replace_entry = Entry(self.win)
 		self.replace_but = Button(
 			self.win,
 			text="Replace",
-			command=self.replace_text
+			command=timed("replace_text", self.replace_text)
 		)
 		self.replace_all_but = Button(
 			self.win,
 			text="Replace All",
-			command=self.replace_all
+			command=timed("replace_all", self.replace_all)
 		)
 
 		self.replace_config()
 
 		self.entry.focus_set()
 
-		self.entry.bind("<Return>", self.find)
+		Tab.latency.bind(self.entry)("<Return>", self.find)
+		self.win.bind("<Destroy>", self.on_destroy)
 
 		self.find_text = None
-		self.occurances = None
-		self.showing = None
+		self.search = None
+		self.matches = None
+		self.showing = -1   # index of the match that is selected, -1 if none is
 		self.selection = None
+		self.time_budget = 2  # seconds Replace All can search for
+		self.view_budget = 0.1  # seconds the matches in view or at the selection can be searched for
+
+		# finds are scanned for on another thread, a find that is waiting for
+		# its match to be found stores whether not finding it is an error
+		self.worker = None
+		self.pending = None
 	
+	def on_destroy(self, event):
+		"""Stop highlighting matches when the window is closed"""
+
+		if event.widget is self.win:
+			self.cancel_search()
+			self.show_matches(None, None)
+
+	def query_changed(self, *args):
+		"""Stop searching for the old text as soon as the query is changed"""
+
+		self.cancel_search()
+		self.matches = None
+		self.error_label.config(text="")
+
+	def close(self):
+		"""Stop searching and close the window, its tab is being closed"""
+
+		self.cancel_search()
+		self.win.destroy()
+
+	def cancel_search(self):
+		if self.worker is not None:
+			self.worker.cancel()
+			self.worker = None
+		self.pending = None
+
 	def replace_config(self, event=None):
 		self.replace_label.grid(row=1, column=0)
 		self.replace_entry.grid(row=1, column=1)
@@ -126,75 +241,171 @@ class FindReplaceWindow:
 				self.error_label.config(text="No text to find")
 				return
 
-			text = self.text_array.get_text()
-			self.occurances = text.split(self.find_text)
-			if len(self.occurances) == 1:
+			if self.search is None or self.search.key != (self.find_text, self.regex.get()):
+				self.showing = -1
+			if self.match_index() is None:
+				return
+			self.showing += inc
+			self.show_occurance(expected)
+
+		return find_suc
+
+	def show_occurance(self, expected):
+		"""Select the match that is showing. If it has not been found yet it is
+		selected when the search finds it."""
+
+		matches = self.matches
+		if not 0 <= self.showing < len(matches):
+			if not matches.complete:
+				self.pending = expected
+				self.selection = None
+				return
+			if not matches:
 				if expected:
 					self.error_label.config(text=f"Can not find '{self.find_text}'")
+				self.pending = None
 				self.selection = None
-				self.showing = None
+				self.showing = -1
+				self.show_matches(None, None)
 				return
+			self.showing %= len(matches)
 
-			self.showing += inc
-			if self.showing < 0 or self.showing > len(self.occurances) - 1:
-				self.showing %= len(self.occurances) - 1
-			selection = self.nth_occurance(self.showing)
-			self.selection = selection
-
-			self.error_label.config(text="")
-			self.highlight(selection)
+		self.pending = None
+		selection = self.nth_occurance(self.showing)
+		self.selection = selection
 
-			self.text_array.x = selection.end.x
-			self.text_array.y = selection.end.y
-			self.scroll()
-			self.update_cursor()
+		if matches.complete:
+			self.error_label.config(text=f"{len(matches)} matches")
+		self.highlight(selection)
+		self.show_matches(self.search, selection)
 
-		return find_suc
+		self.text_array.x = selection.end.x
+		self.text_array.y = selection.end.y
+		self.scroll()
+		self.update_cursor()
 
 	def find(self, event=None):
-		"""Find the text in the entry box and highlight it on the canvas and set
-		self.occurances to the text separated by the occurances"""
+		"""Find the text in the entry box and highlight the first occurance on
+		the canvas"""
 
 		self.find_text = self.entry.get()
 		if self.find_text == "":
 			return
-		
-		text = self.text_array.get_text()
 
-		self.occurances = text.split(self.find_text)
 		self.showing = -1
 		self.find_next_or_prev(1)()
 
-	def nth_occurance(self, n):
-		"""Return a selection of the nth occurance of the text in the entry box"""
+	def create_search(self, budget):
+		"""Return a Search for the text in the entry box with a time budget
+		in seconds or None and show an error if it is not a valid regular
+		expression"""
 
-		if n > len(self.occurances or ()) - 2:
+		try:
+			return Search(self.find_text, self.regex.get(), budget)
+		except re.error as e:
+			self.error_label.config(text=f"Invalid regex: {e}")
 			return None
 
-		occurances_before = self.occurances[:n + 1]
-		text_before = self.find_text.join(occurances_before)
+	def match_index(self):
+		"""Return the MatchIndex for the text in the entry box. The text is
+		only scanned again if it, the text in the entry box or whether it is a
+		regex has changed. The scan runs on another thread and the index is
+		filled in as it finds matches.
 
-		newlines_in_find = self.find_text.count("\n")
+		Return None and show an error if the search is not valid."""
 
-		y1 = text_before.count("\n")
+		search = self.create_search(self.view_budget)
+		if search is None:
+			return None
+		self.search = search
+		if self.matches is None or not self.matches.is_current(self.text_array, search):
+			pending = self.pending
+			self.cancel_search()
+			self.pending = pending
+			self.worker = SearchWorker(
+				self.win,
+				self.text_array,
+				search,
+				self.on_batch,
+				self.on_done,
+				self.on_search_error
+			)
+			self.matches = self.worker.index
+			self.error_label.config(text="Searching...")
+		return self.matches
+
+	def search_outdated(self, index):
+		"""Return whether the text was edited since the search started and
+		start it again if a find is waiting for it"""
+
+		if index.version == self.text_array.version:
+			return False
+		pending = self.pending
+		self.cancel_search()
+		self.matches = None
+		if pending is not None:
+			self.pending = pending
+			self.match_index()
+		return True
+
+	def on_batch(self, index):
+		"""Called by the search worker when it finds more matches"""
+
+		if self.search_outdated(index):
+			return
+		self.error_label.config(text=f"{len(index)} matches so far")
+		if self.pending is not None:
+			self.show_occurance(self.pending)
 
-		x1 = len(text_before.split("\n")[-1])
+	def on_done(self, index):
+		"""Called by the search worker when it has scanned all the text"""
 
-		y2 = newlines_in_find + y1
-		if newlines_in_find:
-			x2 = len(self.find_text.split("\n")[-1])
-		else:
-			x2 = x1 + len(self.find_text)
-		
-		return Selection(x1, y1, x2, y2)
+		if self.search_outdated(index):
+			return
+		self.worker = None
+		self.error_label.config(text=f"{len(index)} matches")
+		if self.pending is not None:
+			self.show_occurance(self.pending)
+
+	def on_search_error(self, error):
+		"""Called by the search worker when the scan fails. The search is
+		started again by the next find."""
+
+		self.worker = None
+		self.matches = None
+		self.pending = None
+		self.error_label.config(text=f"Search failed: {error}")
+
+	def nth_occurance(self, n):
+		"""Return a selection of the nth occurance of the text in the entry box"""
+
+		if self.matches is None or not 0 <= n < len(self.matches):
+			return None
+		return self.matches[n]
 
 	def replace_text(self):
+		if self.pending is not None:
+			return  # the match is selected once the search finds it
 		if not self.selection:
 			self.find_next_or_prev(1)()
+			if self.pending is not None:
+				return
 
 		if self.selection:
-			text = self.replace_entry.get()
-			self.replace(text, self.selection)
+			template = self.replace_entry.get()
+			try:
+				text = self.search.replacement_at(self.text_array, self.selection, template)
+			except SearchTimeout:
+				self.error_label.config(text="Search took too long")
+				return
+			except (re.error, IndexError) as e:
+				self.error_label.config(text=f"Invalid replacement: {e}")
+				return
+			if text is None:
+				# the text changed since the match was found
+				self.selection = None
+			else:
+				self.replace(text, self.selection)
 			self.showing -= 1
 			self.find_next_or_prev(1, expected=False)()
 		else:
@@ -205,30 +416,106 @@ class FindReplaceWindow:
 		if self.find_text == "":
 			return
 
-		replace_text = self.replace_entry.get()
-		text = self.text_array.get_text()
-		new_text = text.replace(self.find_text, replace_text)
-		self.text_array.set_text(new_text)
+		search = self.create_search(self.time_budget)
+		if search is None:
+			return
+		template = self.replace_entry.get()
+		try:
+			# every match is found before anything is replaced
+			replacements = list(search.matches(self.text_array.iter_lines(), template=template))
+		except SearchTimeout:
+			self.error_label.config(text="Search took too long")
+			return
+		except (re.error, IndexError) as e:
+			self.error_label.config(text=f"Invalid replacement: {e}")
+			return
 
-		# TODO: only update lines that changed. also scroll
-		for i in range(0, len(self.text_array)):
-			self.update_line(i)
-		self.update_cursor()
+		self.replace_ranges(replacements)
+		self.selection = None
+		search.budget = self.view_budget   # the matches left in view are searched on every redraw
+		self.show_matches(search, None)
+		self.error_label.config(text=f"Replaced {len(replacements)} occurances")
 
 
 class Tab:
-	def __init__(self, root, filename=None):
+	latency = Latency()   # how long the handlers of every tab take
+
+	def __init__(self, root, filename=None, text_class=TextArray):
 		self.root = root
-		self.text = TextArray()
+		self.text = text_class()
 
 		self.filename = filename
 
 		self.linenumbers = True
-		yview = self.yview_canvases if self.linenumbers else self.canvas.yview
+
+		# only the lines in view and a few either side of them are drawn
+		self.line_items = {}    # line number: canvas text item
+		self.number_items = {}  # line number: line number canvas text item
+		self.overscan = 10
+		self.view = (0, 0)      # lines that should be drawn (first, last + 1)
+		self.widest_line = 0
+
+		# lines hidden by folds are skipped when converting lines to rows
+		self.folds = FoldIndex()
+		self.fold_marks_dirty = False
+
+		# changes to draw once the pending events have been handled
+		self.dirty_lines = set()
+		self.cursor_dirty = False
+		self.scroll_dirty = False
+		self.viewport_dirty = False
+		self.flush_id = None
+		self.timed_flush = self.latency.timed("flush", self.flush)
+
+		# matches of the find window's search that are in view
+		self.find_window = None
+		self.match_search = None
+		self.current_match = None
+		self.match_rects = {}   # line number: (pixel spans, canvas items)
+		# (what was searched, line number: pixel spans) of the last search of
+		# the view, reused until the text, the view or the folds change
+		self.match_spans = None
+		self.match_color = "yellow"
+		self.current_match_color = "orange"
+
+		# colored tokens are drawn over their line by items of their own
+		self.syntax = Highlighter.for_filename(filename)
+		self.token_items = {}   # line number: canvas items of its tokens
+		self.token_looks = {}   # token canvas item: (x, text, color) it was drawn with
+		self.syntax_colors = {
+			"keyword": "blue",
+			"builtin": "purple",
+			"definition": "dark cyan",
+			"decorator": "dark orange",
+			"string": "dark green",
+			"number": "red",
+			"comment": "gray50",
+		}
+
+		# reads the rest of the file while it is opening
+		self.loader = None
+		# why the file stopped loading, the tab only holds part of it so it
+		# can not be saved over the file until it is saved as another
+		self.load_error = None
+		# the changes since the file was saved, to recover if the editor is killed
+		self.journal = Journal(root, filename)
+		self.text.history.journal = self.journal
+
+		# tabs that have not been used for a while give up their canvas items
+		self.last_used = monotonic()
+		self.hibernated = None   # the scroll position while hibernating
+		# writes the file while it is saving
+		self.saver = None
+		self.save_again = False   # whether to save once the current save is done
+		self.save_when_loaded = False   # whether to save once the file has loaded
 
 		self.frame = Frame(self.root)
 		self.canvas = Canvas(self.frame, highlightthickness=0)
-		self.vbar = Scrollbar(self.frame, orient="vertical", command=yview)
+		self.vbar = Scrollbar(
+			self.frame,
+			orient="vertical",
+			command=self.latency.timed("yview_canvases", self.yview_canvases)
+		)
 		self.hbar = Scrollbar(
 			self.frame,
 			orient="horizontal",
@@ -244,9 +531,9 @@ class Tab:
 			xscrollcommand=self.hbar.set,
 			yscrollcommand=self.vbar.set
 		)
-		self.canvas.config(scrollregion=self.canvas.bbox("all"))
 
 		self.highlight_color = "light blue"
+		self.selection_rects = {}   # line number: (pixel span, canvas item)
 		self.set_font_info()
 
 		self.selection = None
@@ -256,19 +543,15 @@ class Tab:
 		self.linenumber_canvas_width = 0
 
 		if self.linenumbers:
-			self.linenumber_canvas_width = self.font.measure("9") * 5 + 4
+			self.linenumber_canvas_width = self.font_metrics.digit_width * 5 + 4
 			self.linenumber_canvas = Canvas(
 				self.frame,
 				width=self.linenumber_canvas_width,
 				highlightthickness=0
 			)
 			self.linenumber_canvas.grid(row=0, column=0, sticky="news")
-			self.create_line_number(1)
 
-			self.linenumber_canvas.config(
-				scrollregion=self.linenumber_canvas.bbox("all")
-			)
-		
+		self.render_viewport()
 		self.bindings()
 		self.update_cursor()
 
@@ -277,13 +560,18 @@ class Tab:
 
 		self.text_color = "black"
 		self.font_size = 12
-		self.font = tkFont.Font(family="courier", size=self.font_size)
-		self.char_height = self.font.metrics("linespace") + 1
+		self.font_metrics = FontMetrics.shared(self.root, "courier", self.font_size)
+		self.font = self.font_metrics.font
+		self.char_height = self.font_metrics.linespace + 1
 		self.x_offset = 10
 		self.y_offset = 5
 		self.x_cursor_offset = self.x_offset - 2
 		self.tab_width = 4  # 4 spaces per tab
 
+		self.glyph_widths = GlyphWidths.shared(self.font, self.tab_width)
+		self.line_widths = {}   # line number: (text, widths of each prefix)
+		self.max_cached_widths = 1000
+
 	def init_cursor(self):
 		"""Create the cursor so that it can be moved later and start toggling
 		it"""
@@ -318,21 +606,196 @@ class Tab:
 		so that they can be bound to the same scrollbar"""
 
 		self.canvas.yview(*args)
-		self.linenumber_canvas.yview(*args)
+		if self.linenumbers:
+			self.linenumber_canvas.yview(*args)
+		self.mark_dirty(viewport=True)
+
+	def mark_dirty(self, *line_numbers, cursor=False, scroll=False, viewport=False):
+		"""Record that lines, the cursor, the scroll position or the viewport
+		need to be redrawn and schedule a flush if one is not pending.
+
+		All of the changes made while handling a burst of events, such as
+		holding down a key, are drawn together once Tk is idle. Nothing is
+		drawn while the tab is hibernating, wake draws everything again."""
+
+		for line_number in line_numbers:
+			self.line_widths.pop(line_number, None)
+			if self.syntax is not None:
+				self.syntax.edited(line_number)
+		if self.hibernated is not None:
+			return   # such as the matches shown by its find window
+		self.dirty_lines.update(line_numbers)
+		self.cursor_dirty |= cursor
+		self.scroll_dirty |= scroll
+		self.viewport_dirty |= viewport
+		if self.flush_id is None:
+			self.flush_id = self.canvas.after_idle(self.timed_flush)
+
+	def flush(self):
+		"""Draw everything that was marked as dirty since the last flush"""
+
+		self.flush_id = None
+		if self.cursor_dirty and self.folds.hidden(self.text.y):
+			self.unfold_lines(self.text.y)
+		if self.syntax is not None:
+			# lines after an edit can change color, such as after typing """
+			changed = self.syntax.update(self.text, self.view[1])
+			first, last = self.view
+			self.dirty_lines.update(self.folds.visible(
+				max(changed.start, first),
+				min(changed.stop, last)
+			))
+
+		if self.viewport_dirty:
+			self.viewport_dirty = False
+			self.render_viewport()
+
+		lines, self.dirty_lines = self.dirty_lines, set()
+		for line_number in sorted(lines):
+			self.update_line(line_number)
+		if self.fold_marks_dirty:
+			self.fold_marks_dirty = False
+			for line_number, item in self.number_items.items():
+				self.linenumber_canvas.itemconfig(
+					item,
+					text=self.line_number_text(line_number + 1)
+				)
+
+		if self.cursor_dirty:
+			self.cursor_dirty = False
+			self.update_cursor()
+		if self.scroll_dirty:
+			self.scroll_dirty = False
+			self.scroll_to_see_cursor()
 
-	def create_line_number(self, line_number):
-		"""Create a line number on the line number canvas"""
+		if self.match_search is not None or self.match_rects:
+			self.render_matches()
+		if self.selection or self.selection_rects:
+			self.render_selection()
 
-		self.linenumber_canvas.create_text(
-			2,
-			(line_number - 1) * self.char_height + self.y_offset,
-			text=f"{line_number:>5}",
-			tag="line_num_" + str(line_number),
-			anchor="nw",
-			font=self.font,
-			fill="light gray"
+	def line_y(self, line_number):
+		"""Return the pixel y coordinate of the top of a line"""
+
+		return self.char_height * self.folds.row(line_number) + self.y_offset
+
+	def in_view(self, line_number):
+		"""Return whether a line is close enough to the screen to be drawn"""
+
+		first, last = self.view
+		return (
+			first <= line_number < last
+			and line_number < len(self.text)
+			and not self.folds.hidden(line_number)
+		)
+
+	def render_viewport(self):
+		"""Draw the lines that are in view and reuse the canvas items of lines
+		that have scrolled out of view for them"""
+
+		top = self.canvas.canvasy(0)
+		height = int(self.canvas["height"])
+		first = int((top - self.y_offset) // self.char_height) - self.overscan
+		last = int((top + height - self.y_offset) // self.char_height) + 1
+		self.view = (
+			self.folds.line(max(first, 0)),
+			self.folds.line(last + self.overscan)
 		)
 
+		spare = [
+			self.line_items.pop(line_number)
+			for line_number in tuple(self.line_items)
+			if not self.in_view(line_number)
+		]
+		spare_tokens = list(chain.from_iterable(
+			self.token_items.pop(line_number)
+			for line_number in tuple(self.token_items)
+			if not self.in_view(line_number)
+		))
+		for line_number in self.folds.visible(*self.view):
+			if not self.in_view(line_number):
+				break
+			if line_number not in self.line_items:
+				self.draw_line(line_number, spare.pop() if spare else None, spare_tokens)
+		if spare:
+			self.canvas.delete(*spare)
+		self.delete_tokens(spare_tokens)
+
+		if self.linenumbers:
+			spare = [
+				self.number_items.pop(line_number)
+				for line_number in tuple(self.number_items)
+				if not self.in_view(line_number)
+			]
+			for line_number in self.folds.visible(*self.view):
+				if not self.in_view(line_number):
+					break
+				if line_number not in self.number_items:
+					self.create_line_number(line_number + 1, spare.pop() if spare else None)
+			if spare:
+				self.linenumber_canvas.delete(*spare)
+
+		self.update_scrollregion()
+
+	def redraw(self):
+		"""Throw away all drawn lines and draw the lines in view again"""
+
+		self.canvas.delete("line", "match", "token")
+		self.line_items.clear()
+		self.match_rects.clear()
+		self.token_items.clear()
+		self.token_looks.clear()
+		self.syntax = Highlighter.for_filename(self.filename)
+		if self.linenumbers:
+			self.linenumber_canvas.delete("line_num")
+			self.number_items.clear()
+		self.widest_line = 0
+		self.line_widths.clear()
+		self.render_viewport()
+		self.update_cursor()
+
+	def update_scrollregion(self):
+		"""Set the scrollregion of the canvases from the number of lines
+		instead of from the items drawn on them"""
+
+		self.scroll_height = self.line_y(len(self.text)) + self.y_offset
+		self.scroll_width = self.widest_line + 2 * self.x_offset
+		self.canvas.config(
+			scrollregion=(0, 0, self.scroll_width, self.scroll_height)
+		)
+		if self.linenumbers:
+			self.linenumber_canvas.config(
+				scrollregion=(0, 0, self.linenumber_canvas_width, self.scroll_height)
+			)
+
+	def create_line_number(self, line_number, item=None):
+		"""Create a line number on the line number canvas if it is in view.
+
+		Reuses item if it is given"""
+
+		if not self.in_view(line_number - 1) or line_number - 1 in self.number_items:
+			return
+		if item is None:
+			item = self.linenumber_canvas.create_text(
+				2,
+				self.line_y(line_number - 1),
+				text=self.line_number_text(line_number),
+				tag="line_num",
+				anchor="nw",
+				font=self.font,
+				fill="light gray"
+			)
+		else:
+			self.linenumber_canvas.itemconfig(item, text=self.line_number_text(line_number))
+			self.linenumber_canvas.coords(item, 2, self.line_y(line_number - 1))
+		self.number_items[line_number - 1] = item
+
+	def line_number_text(self, line_number):
+		"""Return the text of a line number, marked if the line is folded"""
+
+		if self.folds.header(line_number - 1):
+			return f"{line_number:>4}+"
+		return f"{line_number:>5}"
+
 	def delete_line_number(self, line_number=None):
 		"""Delete a line number from the line number canvas.
 		
@@ -342,7 +805,9 @@ class Tab:
 
 		if line_number is None:
 			line_number = len(self.text) + 1
-		self.linenumber_canvas.delete("line_num_" + str(line_number))
+		item = self.number_items.pop(line_number - 1, None)
+		if item is not None:
+			self.linenumber_canvas.delete(item)
 
 	def x_pixel_coor(self, x=None, y=None):
 		"""Return the pixel x coordinate of the character at the given position
@@ -352,8 +817,24 @@ class Tab:
 			x = self.text.x
 		if y is None:
 			y = self.text.y
-		t = "".join(self.text[y][:x]).replace("\t", " " * self.tab_width)
-		return self.font.measure(t)
+		return self.prefix_widths(y)[x]
+
+	def prefix_widths(self, line_number):
+		"""Return a list of the pixel widths of every prefix of a line, so
+		that item x is the width of the first x characters.
+
+		The list is cached until the line is edited."""
+
+		text = self.text[line_number]
+		cached = self.line_widths.get(line_number)
+		if cached is not None and (cached[0] is text or cached[0] == text):
+			return cached[1]
+
+		if len(self.line_widths) >= self.max_cached_widths:
+			self.line_widths.clear()
+		widths = list(accumulate(map(self.glyph_widths.__getitem__, text), initial=0))
+		self.line_widths[line_number] = (text, widths)
+		return widths
 
 	def update_cursor(self):
 		"""Move the cursor to the position specified by the TextArray.
@@ -363,33 +844,340 @@ class Tab:
 		self.canvas.moveto(
 			"cursor",
 			self.x_pixel_coor() + self.x_cursor_offset,
-			self.text.y * self.char_height + self.y_offset
+			self.line_y(self.text.y)
 		)
-		self.canvas.config(scrollregion=self.canvas.bbox("all"))   # not entirely sure when this needs to happen
-		if self.linenumbers:
-			self.linenumber_canvas.config(
-				scrollregion=self.linenumber_canvas.bbox("all")
-			)
+		self.update_scrollregion()
 
 	def update_line(self, line_number):
-		"""Draw the text on the canvas for a specific line"""
+		"""Draw the text on the canvas for a specific line if it is in view.
+		Lines that are not in view have their canvas item removed."""
+
+		if self.in_view(line_number):
+			self.draw_line(line_number)
+		elif line_number in self.line_items:
+			self.canvas.delete(self.line_items.pop(line_number))
+			self.delete_tokens(self.token_items.pop(line_number, ()))
+
+	def lines_inserted(self, line_number, count):
+		"""Move the items of the lines after line_number down to make room for
+		count new lines. Then draw line_number and the new lines."""
+
+		self.unfold_lines(line_number)
+		if self.syntax is not None:
+			self.syntax.lines_inserted(line_number, count)
+		if self.folds:
+			self.folds.shift(line_number + 1, count)
+			self.forget_numbers(line_number + 1)
+		self.shift_items(line_number + 1, count)
+		self.mark_dirty(line_number, viewport=True)
+
+	def lines_removed(self, line_number, count):
+		"""Delete the items of the count lines after line_number and move the
+		items of the lines below them up. Then draw line_number."""
+
+		self.unfold_lines(line_number, line_number + count)
+		removed = [
+			self.line_items.pop(n)
+			for n in tuple(self.line_items)
+			if line_number < n <= line_number + count
+		]
+		removed.extend(chain.from_iterable(
+			self.match_rects.pop(n)[1]
+			for n in tuple(self.match_rects)
+			if line_number < n <= line_number + count
+		))
+		self.delete_tokens(list(chain.from_iterable(
+			self.token_items.pop(n)
+			for n in tuple(self.token_items)
+			if line_number < n <= line_number + count
+		)))
+		if removed:
+			self.canvas.delete(*removed)
+		self.dirty_lines = {
+			n for n in self.dirty_lines
+			if not line_number < n <= line_number + count
+		}
+		if self.syntax is not None:
+			self.syntax.lines_removed(line_number, count)
+		if self.folds:
+			self.folds.shift(line_number + count + 1, -count)
+			self.forget_numbers(line_number + 1)
+		self.shift_items(line_number + count + 1, -count)
+		self.mark_dirty(line_number, viewport=True)
+
+	def forget_numbers(self, start):
+		"""Delete the line numbers of start and every line after it so that
+		they are drawn again. Line numbers stay on the same rows when lines are
+		inserted or removed, but a row can have a different number once the
+		lines above it are folded."""
+
+		self.fold_marks_dirty = True
+		if not self.linenumbers:
+			return
+		numbers = [self.number_items.pop(n) for n in tuple(self.number_items) if n >= start]
+		if numbers:
+			self.linenumber_canvas.delete(*numbers)
+
+	def text_appended(self, line_number, count):
+		"""Draw the text added to the end of line_number and the count lines
+		added after it while the file loads"""
+
+		if self.syntax is not None:
+			self.syntax.lines_inserted(line_number, count)
+		self.mark_dirty(line_number, viewport=True)
+
+	def shift_items(self, start, count):
+		"""Move the items of start and every line after it down by count lines
+		with a single canvas move"""
+
+		self.dirty_lines = {
+			n + count if n >= start else n
+			for n in self.dirty_lines
+		}
+		self.line_widths = {
+			n + count if n >= start else n: widths
+			for n, widths in self.line_widths.items()
+		}
+		moved = {
+			n: item
+			for n, item in self.line_items.items()
+			if n >= start
+		}
+		moved_matches = {
+			n: rects
+			for n, rects in self.match_rects.items()
+			if n >= start
+		}
+		moved_tokens = {
+			n: items
+			for n, items in self.token_items.items()
+			if n >= start
+		}
+		if not moved and not moved_matches and not moved_tokens:
+			return
+		for item in chain(
+			moved.values(),
+			*(rects[1] for rects in moved_matches.values()),
+			*moved_tokens.values()
+		):
+			self.canvas.addtag_withtag("shift", item)
+		self.canvas.move("shift", 0, count * self.char_height)
+		self.canvas.dtag("shift")
+
+		for n in moved:
+			del self.line_items[n]
+		for n, item in moved.items():
+			self.line_items[n + count] = item
+		for n in moved_matches:
+			del self.match_rects[n]
+		for n, rects in moved_matches.items():
+			self.match_rects[n + count] = rects
+		for n in moved_tokens:
+			del self.token_items[n]
+		for n, items in moved_tokens.items():
+			self.token_items[n + count] = items
+
+	def move_rows(self, start, rows):
+		"""Move the items of start and every line after it down by rows rows
+		with a single move on each canvas, for when the lines before them are
+		folded or unfolded. The items stay with the same lines."""
+
+		self.match_spans = None   # other lines are in view
+		items = [item for n, item in self.line_items.items() if n >= start]
+		items.extend(chain.from_iterable(
+			rects[1] for n, rects in self.match_rects.items() if n >= start
+		))
+		items.extend(chain.from_iterable(
+			tokens for n, tokens in self.token_items.items() if n >= start
+		))
+		for item in items:
+			self.canvas.addtag_withtag("shift", item)
+		self.canvas.move("shift", 0, rows * self.char_height)
+		self.canvas.dtag("shift")
+
+		if self.linenumbers:
+			for n, item in self.number_items.items():
+				if n >= start:
+					self.linenumber_canvas.addtag_withtag("shift", item)
+			self.linenumber_canvas.move("shift", 0, rows * self.char_height)
+			self.linenumber_canvas.dtag("shift")
+
+	def fold(self, event=None):
+		"""Hide the indented block that starts on the cursor's line or that
+		the cursor is in"""
+
+		header = self.fold_header(self.text.y)
+		if header is None:
+			return
+		end = self.block_end(header)
+		if end <= header + 1:
+			return
+
+		removed = [self.line_items.pop(n) for n in tuple(self.line_items) if header < n < end]
+		removed.extend(chain.from_iterable(
+			self.match_rects.pop(n)[1]
+			for n in tuple(self.match_rects)
+			if header < n < end
+		))
+		self.delete_tokens(list(chain.from_iterable(
+			self.token_items.pop(n)
+			for n in tuple(self.token_items)
+			if header < n < end
+		)))
+		if removed:
+			self.canvas.delete(*removed)
+		if self.linenumbers:
+			numbers = [self.number_items.pop(n) for n in tuple(self.number_items) if header < n < end]
+			if numbers:
+				self.linenumber_canvas.delete(*numbers)
+
+		hidden = self.folds.fold(header + 1, end)
+		self.move_rows(end, -hidden)
+		if header < self.text.y < end:
+			self.text.cursor = [len(self.text[header]), header]
+		self.clear_selection()
+		self.fold_marks_dirty = True
+		self.mark_dirty(cursor=True, scroll=True, viewport=True)
+
+	def unfold(self, event=None):
+		"""Show the lines of the fold on the cursor's line"""
+
+		self.unfold_lines(self.text.y)
+
+	def unfold_lines(self, first, last=None):
+		"""Remove the folds that start on or hide any of the lines from first
+		to last"""
+
+		if not self.folds:
+			return
+		for start, end in self.folds.unfold(first, last):
+			self.move_rows(end, end - start)
+			self.fold_marks_dirty = True
+			self.mark_dirty(viewport=True)
+
+	def fold_header(self, line_number):
+		"""Return the line that starts the block that line_number is in or
+		starts, or None if it is not in one"""
+
+		line = self.text[line_number]
+		indent = self.indent(line)
+		if line_number + 1 < len(self.text):
+			following = self.text[line_number + 1]
+			if following.strip() and self.indent(following) > indent:
+				return line_number
+		if not line.strip():
+			indent = float("inf")
+		for y in range(line_number - 1, -1, -1):
+			line = self.text[y]
+			if line.strip() and self.indent(line) < indent:
+				return y
+		return None
+
+	def block_end(self, header):
+		"""Return the line after the last line of the block that starts after
+		header. Blank lines at the end of the block are not part of it."""
+
+		indent = self.indent(self.text[header])
+		end = header + 1
+		for y, line in enumerate(self.text.iter_lines(header + 1), header + 1):
+			if not line.strip():
+				continue
+			if self.indent(line) <= indent:
+				break
+			end = y + 1
+		return end
+
+	def indent(self, line):
+		"""Return the width of the whitespace at the start of a line"""
+
+		line = line.expandtabs(self.tab_width)
+		return len(line) - len(line.lstrip())
+
+	def draw_line(self, line_number, item=None, spare_tokens=None):
+		"""Draw a line with its existing canvas item, the given item or a new
+		one if it has neither. Its tokens can be drawn with items taken from
+		spare_tokens, a list of token items that are no longer needed."""
+
+		line = self.text[line_number]
+		if self.syntax is not None:
+			tokens = self.syntax.tokens(self.text, line_number)
+			self.draw_tokens(line_number, line, tokens, spare_tokens)
+			line = _blank_tokens(line, tokens)
 
-		self.canvas.delete(f"line_{line_number}")
-		text = "".join(self.text[line_number]) if line_number < len(self.text) else ""
 		# replace tabs with spaces so that it is drawn correctly
-		text = text.replace("\t", " " * self.tab_width)
-
-		# Can't just use itemconfig because it needs to be drawn a first time
-		# Maybe if you add a check to see if it needs to be drawn
-		self.canvas.create_text(
-			self.x_offset,                                      # x
-			self.char_height * line_number + self.y_offset,     # y
-			text=text,
-			anchor='nw',
-			font=self.font,
-			fill=self.text_color,
-			tag=f"line_{line_number}"
-		)
+		text = line.replace("\t", " " * self.tab_width)
+		self.widest_line = max(self.widest_line, self.prefix_widths(line_number)[-1])
+
+		if line_number in self.line_items:
+			self.canvas.itemconfig(self.line_items[line_number], text=text)
+			return
+		if item is None:
+			item = self.canvas.create_text(
+				self.x_offset,                  # x
+				self.line_y(line_number),       # y
+				text=text,
+				anchor='nw',
+				font=self.font,
+				fill=self.text_color,
+				tag="line"
+			)
+		else:
+			self.canvas.itemconfig(item, text=text)
+			self.canvas.coords(item, self.x_offset, self.line_y(line_number))
+		self.line_items[line_number] = item
+
+	def draw_tokens(self, line_number, line, tokens, spare=None):
+		"""Draw each colored token of a line with its own canvas item.
+
+		The line's items are reused, then items from spare, and only the
+		tokens left over get new items. Items are only changed where their
+		token has moved or changed."""
+
+		old = self.token_items.pop(line_number, ())
+		self.delete_tokens(old[len(tokens):])
+		if not tokens:
+			return
+		widths = self.prefix_widths(line_number)
+		y = self.line_y(line_number)
+		items = []
+		for n, (start, end, tag) in enumerate(tokens):
+			look = (
+				self.x_offset + widths[start],
+				line[start:end].replace("\t", " " * self.tab_width),
+				self.syntax_colors[tag]
+			)
+			if n < len(old):
+				item = old[n]
+				x, text, color = self.token_looks[item]
+				if x != look[0]:
+					self.canvas.coords(item, look[0], y)
+				if text != look[1] or color != look[2]:
+					self.canvas.itemconfig(item, text=look[1], fill=look[2])
+			elif spare:
+				item = spare.pop()
+				self.canvas.coords(item, look[0], y)
+				self.canvas.itemconfig(item, text=look[1], fill=look[2])
+			else:
+				item = self.canvas.create_text(
+					look[0],
+					y,
+					text=look[1],
+					anchor="nw",
+					font=self.font,
+					fill=look[2],
+					tag="token"
+				)
+			self.token_looks[item] = look
+			items.append(item)
+		self.token_items[line_number] = tuple(items)
+
+	def delete_tokens(self, items):
+		"""Delete token items that are no longer needed"""
+
+		if items:
+			self.canvas.delete(*items)
+			for item in items:
+				del self.token_looks[item]
 
 	def arrow(self, direction):
 		"""Factory for arrow event fuctions"""
@@ -398,61 +1186,56 @@ class Tab:
 			def up(event):
 				"""Move the cursor up"""
 
-				self.selection = None
-				self.canvas.delete("selection")
-				if self.text.y <= 0:
+				self.clear_selection()
+				row = self.folds.row(self.text.y)
+				if row <= 0:
 					return
-				self.text.y -= 1
+				self.text.y = self.folds.line(row - 1)
 				if self.text.x > len(self.text.current_line()):
 					self.text.x = len(self.text.current_line())
 
-				self.update_cursor()
-				self.scroll_to_see_cursor()
+				self.mark_dirty(cursor=True, scroll=True)
 			return up
 		elif direction == "down":
 			def down(event):
 				"""Move the cursor down"""
 
-				self.selection = None
-				self.canvas.delete("selection")
-				if self.text.y >= len(self.text.lines) - 1:
+				self.clear_selection()
+				row = self.folds.row(self.text.y)
+				if row >= self.folds.row(len(self.text) - 1):
 					return
-				self.text.y += 1
+				self.text.y = self.folds.line(row + 1)
 				if self.text.x > len(self.text.current_line()):
 					self.text.x = len(self.text.current_line())
 
-				self.update_cursor()
-				self.scroll_to_see_cursor()
+				self.mark_dirty(cursor=True, scroll=True)
 			return down
 		elif direction == "left":
 			def left(event):
 				"""Move the cursor left"""
 
-				self.selection = None
-				self.canvas.delete("selection")
+				self.clear_selection()
 				if self.text.x > 0:
 					self.text.x -= 1
 				elif self.text.y > 0:
-					self.text.y -= 1
+					self.text.y = self.folds.line(self.folds.row(self.text.y) - 1)
 					self.text.x = len(self.text.current_line())
 
-				self.update_cursor()
-				self.scroll_to_see_cursor()
+				self.mark_dirty(cursor=True, scroll=True)
 			return left
 		elif direction == "right":
 			def right(event):
 				"""Move the cursor right"""
 
-				self.selection = None
-				self.canvas.delete("selection")
+				self.clear_selection()
+				row = self.folds.row(self.text.y)
 				if self.text.x < len(self.text.current_line()):
 					self.text.x += 1
-				elif self.text.y < len(self.text) - 1:
+				elif row < self.folds.row(len(self.text) - 1):
 					self.text.x = 0
-					self.text.y += 1
+					self.text.y = self.folds.line(row + 1)
 
-				self.update_cursor()
-				self.scroll_to_see_cursor()
+				self.mark_dirty(cursor=True, scroll=True)
 			return right
 		else:
 			raise ValueError(f"{direction} is not a valid direction")
@@ -469,9 +1252,7 @@ class Tab:
 			self.delete_selection()
 
 		self.text.insert(event.char)
-		self.update_line(self.text.y)
-		self.update_cursor()
-		self.scroll_to_see_cursor()
+		self.mark_dirty(self.text.y, cursor=True, scroll=True)
 
 	def enter_key(self, event=None):
 		"""Insert a newline into the TextArray
@@ -482,14 +1263,8 @@ class Tab:
 		if self.selection:
 			self.delete_selection()
 		self.text.newline()
-		for i in range(self.text.y - 1, len(self.text)):
-			self.update_line(i)
-		self.update_cursor()
-
-		if self.linenumbers:
-			self.create_line_number(len(self.text))
-
-		self.scroll_to_see_cursor()
+		self.lines_inserted(self.text.y - 1, 1)
+		self.mark_dirty(cursor=True, scroll=True)
 
 	def backspace(self, event=None):
 		"""Delete the character to the left of the cursor
@@ -502,17 +1277,14 @@ class Tab:
 			self.delete_selection()
 			return
 		to_update = self.text.backspace()
-		self.update_cursor()
+		self.mark_dirty(cursor=True)
 		if to_update[1] == 0:
 			return
 		elif to_update[1] == 1:
-			self.update_line(to_update[0])
+			self.mark_dirty(to_update[0])
 		else:
-			for line_number in range(to_update[0], len(self.text)+1):
-				self.update_line(line_number)
-				if self.linenumbers:
-					self.delete_line_number()
-			self.scroll_to_see_cursor()
+			self.lines_removed(to_update[0], 1)
+			self.mark_dirty(scroll=True)
 
 	def delete(self, event=None):
 		"""Delete the character to the right of the cursor
@@ -527,12 +1299,9 @@ class Tab:
 		if to_update[1] == 0:
 			return
 		elif to_update[1] == 1:
-			self.update_line(to_update[0])
+			self.mark_dirty(to_update[0])
 		else:
-			for line_number in range(to_update[0], len(self.text)+1):
-				self.update_line(line_number)
-				if self.linenumbers:
-					self.delete_line_number()
+			self.lines_removed(to_update[0], 1)
 
 	def delete_selection(self):
 		"""Delete the selected text"""
@@ -550,33 +1319,15 @@ class Tab:
 		elif y1 == y2 and x1 > x2:
 			x2, x1 = x1, x2
 
-		self.text.cursor = [x1, y1]
-		self.update_cursor()
-		self.selection = None
-		self.canvas.delete("selection")
-
-		if y1 == y2:  # if only deleting part of one line
-			del self.text[y1][x1:x2]
-			self.update_line(y1)
-			return
-		length = len(self.text)
+		self.clear_selection()
 
-		new_y2 = y2
-		line_pops = y2 - y1 - 1
-		if line_pops:   # delete lines that are being completly deleted
-			del self.text.lines[y1 + 1:y2]
-			new_y2 -= line_pops
+		line_pops = self.text.delete_range(x1, y1, x2, y2)
+		self.mark_dirty(cursor=True)
 
-		del self.text[y1][x1:]
-		del self.text[new_y2][:x2]
-		self.delete()
-
-		for line_num in range(y1, length):
-			self.update_line(line_num)
-
-		if self.linenumbers:
-			for line_num in range(length - line_pops, length):
-				self.delete_line_number(line_num+1)
+		if not line_pops:  # if only deleting part of one line
+			self.mark_dirty(y1)
+		else:
+			self.lines_removed(y1, line_pops)
 
 	def ctrl_c(self, event=None):
 		"""Copy the selected text to the clipboard"""
@@ -601,44 +1352,101 @@ class Tab:
 					end = x2
 				else:
 					end = len(self.text[line_number])
-				s += "".join(self.text[line_number][start:end]) + "\n"
-			pyperclip.copy(s[:-1])
+				s += self.text[line_number][start:end] + "\n"
+			clipboard().copy(s[:-1])
 
 	def ctrl_v(self, event=None):
 		"""Paste the text from the clipboard into the TextArray"""
 
-		t = pyperclip.paste()
+		t = clipboard().paste()
 		self.replace(t)
 
 	def replace(self, new_text, selection=None):
+		"""Replace the selection with new_text or insert it at the cursor if
+		nothing is selected. Redraws the changed lines once."""
+
 		if selection is None:
 			selection = self.selection
 			tmp_sel = None
 		else:
 			tmp_sel = self.selection
 
-		if selection:
-			self.delete_selection()
+		with self.text.history.group():
+			if selection:
+				self.selection = selection
+				self.delete_selection()
 
-		for char in new_text:  # simulating keypresses
-			if char == "\n":
-				self.enter_key()
-			else:
-				self.key_press(DummyEvent(char=char))
-		self.selection = tmp_sel
+			first, last = self.text.insert_text(new_text)
+		if first == last:
+			self.mark_dirty(first)
+		else:
+			self.lines_inserted(first, last - first)
+		self.mark_dirty(cursor=True, scroll=True)
+		# the selection that was replaced is not selected again
+		self.selection = tmp_sel if tmp_sel is not selection else None
+
+	def replace_ranges(self, replacements):
+		"""Replace the text between each (start, end, text) in replacements
+		with text. The ranges must be in order and not overlap.
+
+		Only the lines that changed are redrawn and the cursor stays on the
+		same text and the view does not scroll."""
+
+		cx, cy = self.text.cursor
+		with self.text.history.group():
+			# replace from the end so the positions of earlier ranges stay valid
+			for start, end, text in reversed(replacements):
+				removed = self.text.delete_range(start.x, start.y, end.x, end.y)
+				first, last = self.text.insert_text(text)
+				added = last - first
+				if removed:
+					self.lines_removed(first, removed)
+				if added:
+					self.lines_inserted(first, added)
+				self.mark_dirty(first)
+
+				if (end.y, end.x) <= (cy, cx):
+					if end.y == cy:
+						cx += self.text.x - end.x
+					cy += added - removed
+				elif (start.y, start.x) < (cy, cx):
+					# the cursor was inside of the range
+					cx, cy = self.text.cursor
+
+		self.text.cursor = [cx, cy]
+		self.mark_dirty(cursor=True)
+
+	def ctrl_z(self, event=None):
+		"""Undo the last change"""
+
+		self.redraw_changes(self.text.undo())
+
+	def ctrl_y(self, event=None):
+		"""Redo the last change that was undone"""
+
+		self.redraw_changes(self.text.redo())
+
+	def redraw_changes(self, changes):
+		"""Redraw the lines changed by an undo or redo, changes holds
+		(line number, lines removed, lines added) for each change"""
+
+		if not changes:
+			return
+		self.clear_selection()
+		for line_number, removed, added in changes:
+			if removed:
+				self.lines_removed(line_number, removed)
+			if added:
+				self.lines_inserted(line_number, added)
+			self.mark_dirty(line_number)
+		self.mark_dirty(cursor=True, scroll=True)
 
 	def ctrl_d(self, event=None):
 		"""Duplicate the current line"""
 
 		self.text.duplicate_line()
-		for i in range(self.text.y - 1, len(self.text)):
-			self.update_line(i)
-		self.update_cursor()
-
-		if self.linenumbers:
-			self.create_line_number(len(self.text))
-
-		self.scroll_to_see_cursor()
+		self.lines_inserted(self.text.y - 1, 1)
+		self.mark_dirty(cursor=True, scroll=True)
 
 	def ctrl_x(self, event=None):
 		"""Cut the selected text to the clipboard"""
@@ -655,6 +1463,8 @@ class Tab:
 	def ctrl_f(self, event=None):
 		"""Open find window"""
 
+		if self.find_window is not None and self.find_window.win.winfo_exists():
+			self.find_window.close()
 		self.find_window = FindReplaceWindow(
 			parent=self.root,
 			text_array=self.text,
@@ -662,7 +1472,8 @@ class Tab:
 			replace=self.replace,
 			update_cursor=self.update_cursor,
 			scroll=self.scroll_to_see_cursor,
-			update_line=self.update_line,
+			replace_ranges=self.replace_ranges,
+			show_matches=self.show_matches,
 		)
 
 	def mouse_press(self, event):
@@ -670,7 +1481,7 @@ class Tab:
 
 		cx, cy = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
 		x, y = self.move_cursor(cx, cy)
-		self.canvas.delete("selection")
+		self.clear_selection()
 		self.selection = Selection.from_start(x, y)
 
 	def mouse_move(self, event):
@@ -689,6 +1500,7 @@ class Tab:
 		self.canvas.yview_scroll(-1*int(event.delta/120), "units")
 		if self.linenumbers:
 			self.linenumber_canvas.yview_scroll(-1*int(event.delta/120), "units")
+		self.mark_dirty(viewport=True)
 
 	def scroll_to_see_cursor(self):
 		"""Scroll the text so that the cursor is visible"""
@@ -697,18 +1509,17 @@ class Tab:
 		l, r = self.hbar.get()
 		can_height = int(self.canvas["height"])
 		can_width = int(self.canvas["width"])
-		boundingbox = self.canvas.bbox("all")
-		scrollable_height = boundingbox[3]
-		scrollable_width = boundingbox[2]
+		scrollable_height = self.scroll_height
+		scrollable_width = self.scroll_width
 		top_of_screen = t * scrollable_height
 		bottom_of_screen = b * scrollable_height
 		left_of_screen = l * scrollable_width
 		right_of_screen = r * scrollable_width
 
-		cursor_vpos = self.text.y * self.char_height + self.y_offset
+		cursor_vpos = self.line_y(self.text.y)
 		cursor_hpos = self.x_pixel_coor()
 
-		w_width = self.font.measure("W")
+		w_width = self.glyph_widths["W"]
 
 		ahead_cursor = cursor_hpos + w_width
 
@@ -720,11 +1531,13 @@ class Tab:
 			self.canvas.yview_moveto(new_y)
 			if self.linenumbers:
 				self.linenumber_canvas.yview_moveto(new_y)
+			self.render_viewport()
 		elif cursor_vpos < top_of_screen:
 			new_y = cursor_vpos / scrollable_height
 			self.canvas.yview_moveto(new_y)
 			if self.linenumbers:
 				self.linenumber_canvas.yview_moveto(new_y)
+			self.render_viewport()
 		
 		# scroll the width of the previous char
 		if ahead_cursor > max(right_of_screen, can_width):
@@ -734,26 +1547,84 @@ class Tab:
 			new_x = (behind_cursor) / scrollable_width
 			self.canvas.xview_moveto(new_x)
 
+	def show_matches(self, search, current):
+		"""Highlight the matches of search that are in view and the current
+		match, a Selection, in a different color. Stop highlighting if search
+		is None."""
+
+		self.match_search = search
+		self.current_match = current
+		self.mark_dirty()
+
+	def render_matches(self):
+		"""Draw a rectangle behind each part of a match that is in view.
+
+		Only the lines in view are searched, and only again once the text,
+		the view or the search has changed. Only lines whose highlighted spans
+		have changed are redrawn. If the search runs out of time the matches
+		stop being highlighted."""
+
+		spans = {}
+		if self.match_search is not None:
+			first, last = self.view
+			current = self.current_match and tuple(self.current_match.start)
+			searched = (self.match_search.key, current, self.text.version, self.view)
+			if self.match_spans is not None and self.match_spans[0] == searched:
+				spans = self.match_spans[1]
+			else:
+				try:
+					# only the lines that are not hidden by folds are searched
+					for first, end in self.folds.segments(first, min(last, len(self.text))):
+						# a match in view can start on a line above it
+						start = max(first - self.match_search.overlap, 0)
+						lines = (self.text[y] for y in range(start, end))
+						for begin, stop, _ in self.match_search.matches(lines, start):
+							color = self.current_match_color if (begin.x, begin.y) == current else self.match_color
+							for y in range(max(begin.y, first), min(stop.y, end - 1) + 1):
+								x1 = self.x_pixel_coor(begin.x, y) if y == begin.y else 0
+								x2 = self.x_pixel_coor(stop.x if y == stop.y else len(self.text[y]), y)
+								spans.setdefault(y, []).append((x1, x2, color))
+				except SearchTimeout:
+					self.match_search = None
+					spans = {}
+				self.match_spans = (searched, spans)
+
+		for y in tuple(self.match_rects):
+			if tuple(spans.get(y, ())) != self.match_rects[y][0]:
+				self.canvas.delete(*self.match_rects.pop(y)[1])
+		drawn = False
+		for y, line_spans in spans.items():
+			if y in self.match_rects:
+				continue
+			drawn = True
+			items = [
+				self.canvas.create_rectangle(
+					x1 + self.x_cursor_offset + 2, self.line_y(y),
+					x2 + self.x_cursor_offset + 2, self.line_y(y) + self.char_height,
+					fill=color,
+					width=0,
+					tag="match"
+				)
+				for x1, x2, color in line_spans
+			]
+			self.match_rects[y] = (tuple(line_spans), items)
+		if drawn:
+			self.canvas.lower("match")
+
 	def move_cursor(self, xp, yp):
 		"""Convert canvas coordinates to TextArray coordinates and move the
 		TextArray cursor to the new position"""
 
-		y = round((yp - self.y_offset - self.char_height / 2) / self.char_height)
-		if y < 0:
-			y = 0
-		elif y >= len(self.text):
-			y = len(self.text) - 1
+		row = round((yp - self.y_offset - self.char_height / 2) / self.char_height)
+		last_row = self.folds.row(len(self.text) - 1)
+		if row < 0:
+			row = 0
+		elif row > last_row:
+			row = last_row
+		y = self.folds.line(row)
 
-		# binary search
 		# goes 1 place too far right with thin characters eg: "l"
-		l, r = 0, len(self.text[y]) + 1
-		while l < r:
-			m = (l + r) // 2
-			if xp > self.x_pixel_coor(m, y=y):
-				l = m + 1
-			else:
-				r = m
-		x = r - 1
+		x = bisect_left(self.prefix_widths(y), xp) - 1
 
 		if x < 0:
 			x = 0
@@ -761,46 +1632,70 @@ class Tab:
 			x = len(self.text[y])
 		self.text.x = x
 		self.text.y = y
-		self.update_cursor()
+		self.mark_dirty(cursor=True)
 		return x, y
 
 	def highlight_selection(self, selection):
-		"""Highlight the selected text"""
-
-		# TODO: f gets cut off if at the end
+		"""Highlight the selected text once the pending events have been
+		handled"""
 
 		self.selection = selection
+		for y in (selection.start.y, selection.end.y):
+			if self.folds.hidden(y):
+				self.unfold_lines(y)
+		self.mark_dirty()
 
-		if selection.start.y > selection.end.y:
-			selection = Selection(*selection.end, *selection.start)
+	def clear_selection(self):
+		"""Unselect the text and delete its highlight"""
 
+		self.selection = None
 		self.canvas.delete("selection")
+		self.selection_rects.clear()
 
-		for line_number in range(selection.start.y, selection.end.y + 1):
-			y1 = line_number * self.char_height + self.y_offset
-			y2 = (line_number + 1) * self.char_height + self.y_offset
-			if line_number == selection.start.y:
-				# + 2 is to account for f being cut off at the end
-				x1 = self.x_pixel_coor(selection.start.x, y=line_number) + self.x_cursor_offset + 2
-			else:
-				x1 = self.x_cursor_offset + 2
-			if line_number == selection.end.y:
-				x2 = self.x_pixel_coor(selection.end.x, y=line_number) + self.x_cursor_offset + 2
-			else:
-				x2 = self.x_pixel_coor(len(self.text[line_number]), y=line_number) + self.x_cursor_offset + 2
+	def render_selection(self):
+		"""Draw a rectangle behind the selected part of each line in view.
+
+		Only lines whose selected span has changed are redrawn, so dragging a
+		selection or selecting all of a large file costs the lines in view
+		rather than the lines selected."""
 
-			self.canvas.create_rectangle(
+		spans = {}
+		if self.selection:
+			start, end = self.selection.start, self.selection.end
+			if start.y > end.y:
+				start, end = end, start
+			first, last = self.view
+			for y in self.folds.visible(max(start.y, first), min(end.y + 1, last, len(self.text))):
+				# the text may have changed since it was selected
+				length = len(self.text[y])
+				x1 = self.x_pixel_coor(min(start.x, length), y) if y == start.y else 0
+				x2 = self.x_pixel_coor(min(end.x, length) if y == end.y else length, y)
+				# + 2 is to account for f being cut off at the end
+				spans[y] = (x1 + self.x_cursor_offset + 2, x2 + self.x_cursor_offset + 2, self.line_y(y))
+
+		for y in tuple(self.selection_rects):
+			if spans.get(y) != self.selection_rects[y][0]:
+				self.canvas.delete(self.selection_rects.pop(y)[1])
+		drawn = False
+		for y, span in spans.items():
+			if y in self.selection_rects:
+				continue
+			drawn = True
+			x1, x2, y1 = span
+			item = self.canvas.create_rectangle(
 				x1, y1,
-				x2, y2,
+				x2, y1 + self.char_height,
 				fill=self.highlight_color,
 				tag="selection"
 			)
+			self.selection_rects[y] = (span, item)
+		if drawn:
 			self.canvas.lower("selection")
 
 	def bindings(self):
 		"""Bind the keys/events to the appropriate functions"""
 
-		bind = self.canvas.bind
+		bind = self.latency.bind(self.canvas)
 
 		bind("<Key>", self.key_press)
 		bind("<Return>", self.enter_key)
@@ -817,16 +1712,87 @@ class Tab:
 		bind("<Control-x>", self.ctrl_x)
 		bind("<Control-a>", self.ctrl_a)
 		bind("<Control-f>", self.ctrl_f)
+		bind("<Control-z>", self.ctrl_z)
+		bind("<Control-y>", self.ctrl_y)
+		bind("<Control-Z>", self.ctrl_y)  # capital z
+		bind("<Control-bracketleft>", self.fold)
+		bind("<Control-bracketright>", self.unfold)
 
 		bind("<Button-1>", self.mouse_press)  # left click
 		bind("<B1-Motion>", self.mouse_move)  # drag mouse while left click
 		bind("<MouseWheel>", self.scrollwheel)
 		if self.linenumbers:
-			self.linenumber_canvas.bind("<MouseWheel>", self.scrollwheel)
+			self.latency.bind(self.linenumber_canvas)("<MouseWheel>", self.scrollwheel)
+
+	def hibernate(self):
+		"""Free the canvas items and caches of a tab that is not being used.
+		The text, cursor, selection and undo history are kept so that wake can
+		draw it again where it was."""
+
+		if self.flush_id is not None:
+			self.canvas.after_cancel(self.flush_id)
+			self.flush_id = None
+		self.dirty_lines.clear()
+		self.cursor_dirty = self.scroll_dirty = self.viewport_dirty = False
+		self.fold_marks_dirty = False
+
+		self.hibernated = (self.canvas.xview()[0], self.canvas.yview()[0])
+		self.canvas.delete("line", "match", "token", "selection")
+		self.line_items.clear()
+		self.match_rects.clear()
+		self.selection_rects.clear()
+		self.token_items.clear()
+		self.token_looks.clear()
+		if self.linenumbers:
+			self.linenumber_canvas.delete("line_num")
+			self.number_items.clear()
+		self.line_widths.clear()
+		self.syntax = None   # the lexer states are found again when drawn
+		self.view = (0, 0)
+
+	def wake(self):
+		"""Draw a hibernated tab again at the scroll position it had"""
+
+		x, y = self.hibernated
+		self.hibernated = None
+		self.scroll_to(x, y)
+		self.redraw()
+		if self.selection:
+			self.highlight_selection(self.selection)
+
+	def scroll_to(self, x, y):
+		"""Scroll the canvases to fractions of the width and height of the
+		text"""
+
+		self.update_scrollregion()
+		self.canvas.xview_moveto(x)
+		self.canvas.yview_moveto(y)
+		if self.linenumbers:
+			self.linenumber_canvas.yview_moveto(y)
+		self.mark_dirty(viewport=True)
+
+	def restore_view(self, cursor=None, scroll=None):
+		"""Move the cursor and scroll back to where they were in the last
+		session. The cursor is moved inside the text if it has got shorter."""
+
+		if cursor:
+			x, y = cursor
+			y = min(max(y, 0), len(self.text) - 1)
+			self.text.cursor = [min(max(x, 0), len(self.text[y])), y]
+		if scroll:
+			self.scroll_to(*scroll)
+		self.mark_dirty(cursor=True)
 
 	def destroy_widgets(self):
 		"""Destroy all widgets belonging to the tab"""
 
+		if self.find_window is not None and self.find_window.win.winfo_exists():
+			self.find_window.close()   # it would draw on the destroyed canvas
+		self.find_window = None
+		if self.flush_id is not None:
+			self.canvas.after_cancel(self.flush_id)
+		if self.loader is not None:
+			self.loader.cancel()
 		self.frame.destroy()
 		# must destroy widgets before tag object can be garbage collected
 		self.canvas.destroy()
@@ -836,6 +1802,23 @@ class Tab:
 			self.linenumber_canvas.destroy()
 
 
+_NOT_TAB = re.compile(r"[^\t]")
+
+
+def _blank_tokens(line, tokens):
+	"""Return the line with the characters of tokens replaced by spaces so
+	they are not drawn twice. Tabs are kept so the rest of the line lines up."""
+
+	parts = []
+	pos = 0
+	for start, end, _ in tokens:
+		parts.append(line[pos:start])
+		parts.append(_NOT_TAB.sub(" ", line[start:end]))
+		pos = end
+	parts.append(line[pos:])
+	return "".join(parts)
+
+
 class CurrentTab:
 	"""Class to do things that need to be done every time the current tab is
 	changed"""
@@ -859,11 +1842,14 @@ class CurrentTab:
 		"""
 
 		try:
+			instance.current_tab.last_used = monotonic()
 			if instance.current_tab.button.winfo_exists():
 				instance.current_tab.button.config(bg="SystemButtonFace")   # default button color
 				instance.current_tab.close_button.config(bg="SystemButtonFace")
 		except AttributeError:  # if the current tab is None
 			pass
+		if value.hibernated is not None:
+			value.wake()
 		instance.__dict__[self.name] = value
 		instance.current_tab_button = value.button
 		value.button.config(bg="grey")
@@ -875,7 +1861,9 @@ class TextEditor:
 
 	current_tab = CurrentTab()
 
-	def __init__(self):
+	def __init__(self, text_class=TextArray):
+		self.text_class = text_class
+
 		self.root = Tk()
 		self.root.title("Text Editor")
 		self.window_shape = (500, 400)
@@ -891,7 +1879,25 @@ class TextEditor:
 
 		self.tabs = {}          #  id(selection button): Tab
 		self.tab_buttons = {}   #  id(selection button): (selection button, close_button)
-		self.newfile()
+		# tabs from the last session are only created once they are selected
+		self.lazy_tabs = {}     #  id(selection button): (session tab, Recovered or None)
+		recovered = {journal.name: journal for journal in Journal.recover()}
+		if not self.restore_session(recovered):
+			self.newfile()
+		self.recover_tabs(recovered.values())
+		self.session_interval = 60000  # ms between saves of the session
+		self.root.after(self.session_interval, self.autosave_session)
+		self.root.protocol("WM_DELETE_WINDOW", self.quit)
+
+		# seconds a tab can go unused before it hibernates
+		self.hibernate_after = 300
+		self.hibernate_interval = 60000  # ms between checks for unused tabs
+		self.root.after(self.hibernate_interval, self.hibernate_tabs)
+
+		# how long each handler takes, drawn over the current tab
+		self.overlay_canvas = None   # the canvas the overlay is drawn on, if shown
+		self.overlay_after = None
+		self.overlay_interval = 500  # ms between redraws of the overlay
 
 		self.bindings()
 		self.init_menu()
@@ -899,19 +1905,34 @@ class TextEditor:
 	def init_menu(self):
 		"""Create the menu bar and add the menu items"""
 
+		timed = Tab.latency.timed
+
 		self.menu = Menu(self.root)
 		self.filemenu = Menu(self.menu, tearoff=0)
-		self.filemenu.add_command(label="New                 Ctrl+n", command=self.newfile)
-		self.filemenu.add_command(label="Open                Ctrl+o", command=self.openfile)
-		self.filemenu.add_command(label="Save                Ctrl+s", command=self.save)
-		self.filemenu.add_command(label="Save as       Ctrl+Shift+s", command=self.saveas)
+		self.filemenu.add_command(label="New                 Ctrl+n", command=timed("newfile", self.newfile))
+		self.filemenu.add_command(label="Open                Ctrl+o", command=timed("openfile", self.openfile))
+		self.filemenu.add_command(label="Save                Ctrl+s", command=timed("save", self.save))
+		self.filemenu.add_command(label="Save as       Ctrl+Shift+s", command=timed("saveas", self.saveas))
 		self.menu.add_cascade(label="File", menu=self.filemenu)
 
 		self.editmenu = Menu(self.menu, tearoff=0)
+		self.editmenu.add_command(label="Undo                Ctrl-z", command=self.delegate_to_tab("ctrl_z"))
+		self.editmenu.add_command(label="Redo                Ctrl-y", command=self.delegate_to_tab("ctrl_y"))
 		self.editmenu.add_command(label="Cut                 Ctrl-x", command=self.delegate_to_tab("ctrl_x"))
 		self.editmenu.add_command(label="Copy                Ctrl-c", command=self.delegate_to_tab("ctrl_c"))
 		self.editmenu.add_command(label="Paste               Ctrl-v", command=self.delegate_to_tab("ctrl_v"))
 		self.menu.add_cascade(label="Edit", menu=self.editmenu)
+
+		self.debugmenu = Menu(self.menu, tearoff=0)
+		self.debugmenu.add_command(
+			label="Latency overlay  Ctrl+Shift+l",
+			command=timed("toggle_latency_overlay", self.toggle_latency_overlay)
+		)
+		self.debugmenu.add_command(
+			label="Dump latency     Ctrl+Shift+d",
+			command=timed("dump_latency", self.dump_latency)
+		)
+		self.menu.add_cascade(label="Debug", menu=self.debugmenu)
 		self.root.config(menu=self.menu)
 
 	def tab_row_creation(self):
@@ -955,39 +1976,69 @@ class TextEditor:
 
 		self.tab_button_canvas.configure(scrollregion=self.tab_button_canvas.bbox("all"))
 
-	def create_tab(self, filename=None):
-		"""Create a new tab and is widgets and add it to the list of tabs"""
+	def create_tab(self, filename=None, buttons=None):
+		"""Create a new tab and is widgets and add it to the list of tabs.
+		Uses the buttons made for a tab from the last session if given."""
 
-		tab = Tab(self.root, filename=filename)
+		tab = Tab(self.root, filename=filename, text_class=self.text_class)
 
-		text = tab.filename if tab.filename else "untitled"
-		button = Button(
-			self.inner_frame,
-			text=text,
-			command=self.select_tab(tab)
-		)
+		if buttons is None:
+			buttons = self.create_tab_buttons(filename)
+		button, close_button = buttons
+		button.config(command=Tab.latency.timed("select_tab", self.select_tab(tab)))
+		close_button.config(command=Tab.latency.timed("close_tab", self.close_tab(tab, id(button))))
+
+		tab.button = button
+		tab.close_button = close_button
+		self.tabs[id(button)] = tab
+
+		self.resize_tab(tab)
+
+		return tab
+
+	def create_tab_buttons(self, filename=None):
+		"""Create the buttons to select and close a tab and add them to the
+		row of tabs. Their commands are set once there is a tab."""
+
+		button = Button(self.inner_frame, text=self.tab_name(filename))
 		close_button = Button(
 			self.inner_frame,
 			width=2,
 			text="X",
 			fg="red",
-			command=self.close_tab(tab, id(button))
 		)
 
 		button.pack(side="left")
 		close_button.pack(side="left")
 
-		tab.button = button
-		tab.close_button = close_button
 		self.tab_buttons[id(button)] = (
 			button,
 			close_button
 			)
-		self.tabs[id(button)] = tab
+		return button, close_button
 
-		self.resize_tab(tab)
+	def remove_tab_buttons(self, button_id):
+		"""Destroy the buttons of a tab that is being closed"""
 
-		return tab
+		buttons = self.tab_buttons.pop(button_id)
+		buttons[0].pack_forget()
+		buttons[1].pack_forget()
+		buttons[0].destroy()
+		buttons[1].destroy()
+
+	def tab_name(self, filename):
+		"""Return the text of the button of a tab with the given filename"""
+
+		return filename.split("/")[-1] if filename else "untitled"
+
+	def show_status(self, tab, status=None):
+		"""Show the status of the tab's file after its name on its button, or
+		just its name if status is None"""
+
+		if not tab.button.winfo_exists():
+			return  # the tab has been closed
+		name = self.tab_name(tab.filename)
+		tab.button.config(text=name if status is None else f"{name} ({status})")
 
 	def select_tab(self, tab):
 		"""Return a function that will select the tab"""
@@ -1014,16 +2065,16 @@ class TextEditor:
 			"""Remove the tab from the list of tabs and destroy the buttons to
 			switch to the tab and set the new current tab"""
 
-			buttons = self.tab_buttons[button_id]
-			buttons[0].pack_forget()
-			buttons[1].pack_forget()
-			buttons[0].destroy()
-			buttons[1].destroy()
-			del self.tab_buttons[button_id]
+			self.remove_tab_buttons(button_id)
+			tab.journal.discard()
+			if self.overlay_canvas is tab.canvas:
+				self.clear_latency_overlay()   # it is drawn on the next tab next time
 			tab.destroy_widgets()
 			del self.tabs[button_id]
 
 			if self.current_tab == tab:
+				if not self.tabs and self.lazy_tabs:
+					self.restore_tab(next(iter(self.lazy_tabs)))
 				if len(self.tabs) > 0:
 					next_tab = tuple(self.tabs.values())[0]
 					next_tab.frame.grid()
@@ -1034,9 +2085,10 @@ class TextEditor:
 		return close
 
 	def delegate_to_tab(self, method):
-		"""Return a function that will call the current_tab's method"""
+		"""Return a function that will call the current_tab's method, timed
+		under the method's name"""
 
-		return lambda: getattr(self.current_tab, method)()
+		return Tab.latency.timed(method, lambda: getattr(self.current_tab, method)())
 
 	def tab_key(self, event):
 		"""Stop the tab from changing the focus on the main window. Tab will
@@ -1048,47 +2100,309 @@ class TextEditor:
 		"""Save the current tab's text to the tab's filename. Call saveas if
 		the tab has no filename."""
 
+		if self.current_tab.load_error is not None:
+			return  # the rest of the file could not be read, use saveas
 		if not self.current_tab.filename:
 			self.saveas(event)
 		else:
-			with open(self.current_tab.filename, "w") as file:
-				file.write(self.current_tab.text.get_text())
+			self.save_tab(self.current_tab)
 
 	def saveas(self, event=None):
 		"""Get the user to select a filename and save the current tab's text"""
 
-		fname = FD.asksaveasfilename(
+		fname = file_dialogs().asksaveasfilename(
 			defaultextension=".txt",
 			filetypes=[("Text Files", "*.txt")]
 		)
 		if not fname: # asksaveasfile return "" if dialog closed with "cancel".
 			return
 		self.current_tab.filename = fname
-		self.current_tab_button.config(text=fname.split("/")[-1])
-		with open(fname, "w") as file:
-			file.write(self.current_tab.text.get_text())
+		self.current_tab.load_error = None
+		self.save_tab(self.current_tab)
+		self.current_tab.redraw()  # the new extension can change the colors
+
+	def save_tab(self, tab):
+		"""Write a snapshot of the tab's text to its file on another thread.
+		A save started while another is running waits for it to finish so
+		that the last save is the one that is kept. A save started while the
+		file is loading waits for the rest of it to load."""
+
+		if tab.loader is not None:
+			# saving part of the file would lose the rest of it
+			tab.save_when_loaded = True
+			self.show_load_progress(tab)
+			return
+		if tab.saver is not None:
+			tab.save_again = True
+			return
+		self.show_status(tab, "saving")
+		# the changes after the snapshot go into a new part of the journal
+		before_replace, replaced = tab.journal.checkpoint(tab.filename)
+		# the root outlives the tab so the save finishes if the tab is closed
+		tab.saver = FileSaver(
+			self.root,
+			tab.text,
+			tab.filename,
+			self.file_saved(tab, tab.journal.segment, replaced),
+			before_replace=before_replace
+		)
+
+	def file_saved(self, tab, segment, replaced):
+		"""Return a function that shows that the tab's file has been saved or
+		that saving it failed"""
+
+		def saved(error):
+			tab.saver = None
+			if error is not None:
+				# the journal still has the edits, so the tab stays unsaved
+				tab.save_again = False
+				self.show_status(tab, f"not saved: {error}")
+				return
+			replaced()
+			tab.journal.saved(segment)
+			if tab.save_again:
+				tab.save_again = False
+				self.save_tab(tab)
+			else:
+				self.show_status(tab)
+		return saved
 
 	def openfile(self, event=None):
 		"""Get the user to select a filename and open it in a new tab or the
 		current tab if it is empty and has no filename."""
 
-		fname = FD.askopenfilename()
+		fname = file_dialogs().askopenfilename()
 		if not fname:
 			return
 		if self.current_tab.filename is None and not self.current_tab.text.get_text():
-			self.current_tab_button.config(text=fname.split("/")[-1])
 			self.current_tab.filename = fname
 		else:
 			self.current_tab = self.create_tab(filename=fname)
 
-		with open(fname, "r") as file:
-			text = file.read()
-		self.current_tab.text.set_text(text)
-		for line_number in range(len(self.current_tab.text)):
-			self.current_tab.update_line(line_number)
-			if self.current_tab.linenumbers:
-				self.current_tab.create_line_number(line_number+1)
-		self.current_tab.update_cursor()
+		self.load_file(self.current_tab, fname)
+
+	def load_file(self, tab, fname, then=None):
+		"""Read a file into a tab, then is called once all of it has loaded.
+		Raises OSError if the file can not be opened."""
+
+		# the first screen is drawn from the start of the file and the rest
+		# is added to the end of the text as it is read
+		tab.loader = FileLoader(
+			tab.canvas,
+			tab.text,
+			fname,
+			self.file_chunk_loaded(tab),
+			self.file_loaded(tab, then),
+			self.file_load_failed(tab)
+		)
+		tab.load_error = None
+		tab.save_when_loaded = False
+		tab.journal.restart(fname)
+		tab.folds = FoldIndex()
+		tab.redraw()
+		self.show_load_progress(tab)
+
+	def show_load_progress(self, tab):
+		"""Show how much of the tab's file has loaded and whether it will be
+		saved once it has"""
+
+		status = f"{tab.loader.progress:.0%}"
+		if tab.save_when_loaded:
+			status += ", saving when loaded"
+		self.show_status(tab, status)
+
+	def file_chunk_loaded(self, tab):
+		"""Return a function that draws a chunk of a file that has been added
+		to the tab's text and shows how much has loaded"""
+
+		def chunk_loaded(line_number, count):
+			tab.text_appended(line_number, count)
+			self.show_load_progress(tab)
+		return chunk_loaded
+
+	def file_loaded(self, tab, then=None):
+		"""Return a function that shows that a file has finished loading and
+		calls then"""
+
+		def loaded():
+			tab.loader = None
+			if tab.save_when_loaded:
+				tab.save_when_loaded = False
+				self.save_tab(tab)
+			else:
+				self.show_status(tab)
+			if then is not None:
+				then()
+		return loaded
+
+	def file_load_failed(self, tab):
+		"""Return a function that shows why a file stopped loading and stops
+		the part of it that loaded from being saved over it"""
+
+		def failed(error):
+			tab.loader = None
+			tab.load_error = error
+			tab.save_when_loaded = False   # only saveas can save the part that loaded
+			self.show_status(tab, f"failed to load: {error}")
+		return failed
+
+	def hibernate_tabs(self):
+		"""Hibernate the tabs that have not been used for hibernate_after
+		seconds and check again in hibernate_interval ms"""
+
+		now = monotonic()
+		for tab in self.tabs.values():
+			if (
+				tab is not self.current_tab
+				and tab.hibernated is None
+				and tab.loader is None   # loading draws the lines it adds
+				and now - tab.last_used > self.hibernate_after
+			):
+				tab.hibernate()
+		self.root.after(self.hibernate_interval, self.hibernate_tabs)
+
+	def recover_tabs(self, journals):
+		"""Open a tab for each journal that is not part of the last session,
+		left by an editor that was killed"""
+
+		for recovered in journals:
+			if self.current_tab.filename is None and not self.current_tab.text.get_text():
+				self.current_tab.filename = recovered.filename
+			else:
+				self.current_tab = self.create_tab(filename=recovered.filename)
+			self.replay_journal(self.current_tab, recovered)
+			self.show_status(self.current_tab, "recovered")
+
+	def replay_journal(self, tab, recovered):
+		"""Replay the changes in a journal onto the file they were made to and
+		keep adding to the journal"""
+
+		text = ""
+		if recovered.base is not None:
+			try:
+				with open(recovered.base, "r") as file:
+					text = file.read()
+			except OSError:
+				pass  # the changes are replayed onto an empty text
+		tab.text.set_text(text)
+		tab.text.history.journal = None   # the changes are already journaled
+		try:
+			tab.text.history.replay(tab.text, recovered.changes)
+		except IndexError:
+			pass  # the file was changed after the journal was written
+		# keep adding to the journal so the changes are not lost until saved
+		tab.journal = Journal(
+			self.root,
+			recovered.filename,
+			recovered.name,
+			recovered.segment + 1,
+			recovered.lock
+		)
+		tab.text.history.journal = tab.journal
+		tab.redraw()
+
+	def restore_session(self, recovered):
+		"""Create the buttons of the tabs that were open when the editor was
+		last closed, taking their journals out of recovered. Only the current
+		tab is created and has its file read, the others are when they are
+		first selected. Return whether there were any tabs."""
+
+		current = None
+		for entry in Session.load():
+			button, close_button = self.create_tab_buttons(entry.get("filename"))
+			button_id = id(button)
+			journal = recovered.pop(entry.get("journal"), None)
+			self.lazy_tabs[button_id] = (entry, journal)
+			button.config(command=Tab.latency.timed("select_lazy_tab", self.select_lazy_tab(button_id)))
+			close_button.config(command=Tab.latency.timed("close_lazy_tab", self.close_lazy_tab(button_id)))
+			if current is None or entry.get("current"):
+				current = button_id
+		if current is None:
+			return False
+		self.current_tab = self.restore_tab(current)
+		return True
+
+	def restore_tab(self, button_id):
+		"""Create a tab from the last session with the buttons that were
+		made for it and read its file"""
+
+		entry, journal = self.lazy_tabs.pop(button_id)
+		tab = self.create_tab(entry.get("filename"), self.tab_buttons[button_id])
+		cursor, scroll = entry.get("cursor"), entry.get("scroll")
+		if journal is not None:
+			self.replay_journal(tab, journal)
+			tab.restore_view(cursor, scroll)
+			self.show_status(tab, "unsaved")
+		elif tab.filename:
+			def restore_view():
+				# unless the cursor was moved while the file was loading
+				if tab.text.cursor == [0, 0]:
+					tab.restore_view(cursor, scroll)
+			try:
+				self.load_file(tab, tab.filename, restore_view)
+			except (OSError, ValueError):
+				self.show_status(tab, "not found")
+		return tab
+
+	def select_lazy_tab(self, button_id):
+		"""Return a function that creates a tab from the last session and
+		selects it"""
+
+		def select():
+			self.select_tab(self.restore_tab(button_id))()
+		return select
+
+	def close_lazy_tab(self, button_id):
+		"""Return a function that closes a tab from the last session that has
+		not been selected"""
+
+		def close():
+			_, journal = self.lazy_tabs.pop(button_id)
+			self.remove_tab_buttons(button_id)
+			if journal is not None:
+				Journal(
+					self.root,
+					journal.filename,
+					journal.name,
+					journal.segment,
+					journal.lock
+				).discard()
+		return close
+
+	def save_session(self):
+		"""Save the open tabs so that they are restored when the editor is
+		next started. Their unsaved changes are kept in their journals."""
+
+		tabs = []
+		for button_id in self.tab_buttons:
+			if button_id in self.lazy_tabs:
+				tabs.append(dict(self.lazy_tabs[button_id][0], current=False))
+				continue
+			tab = self.tabs[button_id]
+			if tab.filename is None and len(tab.text) == 1 and not tab.text[0]:
+				continue  # an empty tab
+			scroll = tab.hibernated or (tab.canvas.xview()[0], tab.canvas.yview()[0])
+			tabs.append({
+				"filename": tab.filename,
+				"journal": tab.journal.name,
+				"cursor": tab.text.cursor,
+				"scroll": scroll,
+				"current": tab is self.current_tab,
+			})
+		Session.save(tabs)
+
+	def autosave_session(self):
+		"""Save the session every session_interval ms so that the tabs are
+		restored even if the editor is killed"""
+
+		self.save_session()
+		self.root.after(self.session_interval, self.autosave_session)
+
+	def quit(self):
+		"""Save the session and close the window"""
+
+		self.save_session()
+		self.root.destroy()
 
 	def newfile(self, event=None):
 		"""Create a new tab and make it the current tab."""
@@ -1115,11 +2429,13 @@ class TextEditor:
 		tab.canvas.config(width = new_width, height = new_height)
 		if tab.linenumbers:
 			tab.linenumber_canvas.config(height = new_height)
+		if tab.hibernated is None:
+			tab.render_viewport()
 
 	def bindings(self):
 		"""Bind editor wide events."""
 
-		bind = self.root.bind
+		bind = Tab.latency.bind(self.root)
 
 		self.root.unbind_all("<Tab>")
 
@@ -1129,18 +2445,86 @@ class TextEditor:
 		bind("<Control-S>", self.saveas)  # capital s
 		bind("<Control-o>", self.openfile)
 		bind("<Control-n>", self.newfile)
+		bind("<Control-L>", self.toggle_latency_overlay)  # capital l
+		bind("<Control-D>", self.dump_latency)  # capital d
 
 		bind("<Configure>", self.on_resize)
 
+	def toggle_latency_overlay(self, event=None):
+		"""Show or hide how long each event handler has taken over the current
+		tab"""
+
+		if self.overlay_after is None:
+			self.draw_latency_overlay()
+			return
+		self.root.after_cancel(self.overlay_after)
+		self.overlay_after = None
+		self.clear_latency_overlay()
+
+	def clear_latency_overlay(self):
+		"""Delete the overlay from the canvas it is drawn on, unless the canvas
+		has been destroyed with its tab"""
+
+		if self.overlay_canvas is not None and self.overlay_canvas.winfo_exists():
+			self.overlay_canvas.delete("latency")
+		self.overlay_canvas = None
+
+	def draw_latency_overlay(self):
+		"""Draw how long each event handler has taken in the top right of the
+		current tab and draw it again in overlay_interval ms"""
+
+		self.clear_latency_overlay()
+		tab = self.current_tab
+		canvas = self.overlay_canvas = tab.canvas
+		text = canvas.create_text(
+			canvas.canvasx(canvas.winfo_width()) - 10,
+			canvas.canvasy(0) + 5,
+			text=Tab.latency.summary(),
+			anchor="ne",
+			font=tab.font,
+			tag="latency"
+		)
+		canvas.create_rectangle(
+			*canvas.bbox(text),
+			fill="white",
+			outline="gray",
+			tag="latency"
+		)
+		canvas.tag_raise(text)
+		self.overlay_after = self.root.after(self.overlay_interval, self.draw_latency_overlay)
+
+	def dump_latency(self, event=None):
+		"""Write how long each event handler has taken and the stacks of the
+		slow calls to a JSON file that the user selects"""
+
+		fname = file_dialogs().asksaveasfilename(
+			defaultextension=".json",
+			initialfile="latency.json"
+		)
+		if fname:
+			Tab.latency.dump(fname)
+
 	def mainloop(self):
 		"""Start the mainloop."""
 
 		self.root.mainloop()
+		Tab.latency.stop()
+		for tab in self.tabs.values():
+			tab.journal.close()
 
 
 
 def main():
-	t = TextEditor()
+	parser = ArgumentParser(description="Text Editor")
+	parser.add_argument(
+		"--engine",
+		choices=ENGINES,
+		default="deque",
+		help="how the text of each tab is stored"
+	)
+	args = parser.parse_args()
+
+	t = TextEditor(text_class=ENGINES[args.engine])
 	t.mainloop()
 
 if __name__ == "__main__":